@@ -0,0 +1,60 @@
+"""
+The coroutine functions that json_validate_async and json_validate_warn_async
+wrap coroutine functions with.  async def is a syntax error on Python 2, so
+json_validate only imports this on Python 3.5 or later.
+
+This imports nothing from json_validate:  it's given json_validate's functions
+instead, so it works with whichever copy of json_validate wraps a function,
+even __main__ when json_validate.py runs its doctests.
+"""
+import asyncio
+import functools
+
+def checker(plan):
+    """
+    @param plan:    A function that takes client input and returns the
+                    JSONException it doesn't validate with or None, and None;
+                    or None and (executor, function, *args) to check it in
+                    executor, where function returns a list of one
+                    validation_error or None
+    @return:        A coroutine function that takes client input and returns
+                    the JSONException it doesn't validate with, or None
+    """
+    async def check(client_json):
+        e, job = plan(client_json)
+        if job is not None:
+            errors = await asyncio.get_event_loop().run_in_executor(*job)
+            e = errors[0] and errors[0].exception()
+        return e
+    return check
+
+def validator(f, json_structure, check):
+    @functools.wraps(f)
+    async def validator(self, json):
+        e = await check(json)
+        if e is not None:
+            # If JSON doesn't validate, add some extra debugging info
+            e.client_json = json
+            e.json_structure = json_structure
+            raise e
+        
+        # JSON validated.
+        return await f(self, json)
+    return validator
+
+def warner(f, check, policy, add_warning):
+    @functools.wraps(f)
+    async def validate_warner(json,context,*args,**kwargs):
+        warning = None
+        if policy.sampled():
+            e = await check(json)
+            if e is not None:
+                # Didn't validate
+                warning = policy.warn(context, e)
+        
+        rv = await f(json,context,*args,**kwargs)
+        
+        if warning:
+            add_warning(rv, warning)
+        return rv
+    return validate_warner
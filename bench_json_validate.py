@@ -0,0 +1,232 @@
+"""
+Benchmarks for json_validate's hot paths.
+
+Runs synthetic structures and client input through each validation engine
+and reports operations per second, the peak number of objects allocated per
+operation, and on Python 3 the peak bytes allocated per operation.  Save the
+results as a baseline and compare later runs to it to catch regressions:
+
+    python bench_json_validate.py --save baseline.json
+    python bench_json_validate.py --compare baseline.json
+
+--compare exits with status 1 if any benchmark is slower than the baseline by
+more than --threshold percent.
+"""
+import gc
+import sys
+import json
+import time
+import argparse
+import functools
+
+try:
+    import tracemalloc
+except ImportError:
+    # Python 2
+    tracemalloc = None
+
+from json_validate import *
+
+
+def _flat():
+    schema = dict(('key%d' % i, [int, float, str][i % 3]) for i in range(50))
+    good = dict(('key%d' % i, [i, i + 0.5, 'value'][i % 3]) for i in range(50))
+    return schema, good, dict(good, key0='not an int')
+
+def _deep():
+    schema, good = int, 1
+    for i in range(50):
+        schema, good = {'child': schema, 'name': str}, {'child': good, 'name': 'level %d' % i}
+    bad = json.loads(json.dumps(good))
+    node = bad
+    while isinstance(node['child'], dict):
+        node = node['child']
+    node['child'] = 'not an int'
+    return schema, good, bad
+
+def _int_list():
+    good = list(range(100000))
+    return {'values': [int]}, {'values': good}, {'values': good[:-1] + ['not an int']}
+
+def _list_of_dicts():
+    schema = {'rows': [{'id': int, 'name': str, 'score': float, 'tags': [str]}]}
+    rows = [{'id': i, 'name': 'row', 'score': 0.5, 'tags': ['a', 'b']} for i in range(2000)]
+    bad = [dict(row) for row in rows]
+    bad[-1]['score'] = 'not a float'
+    return schema, {'rows': rows}, {'rows': bad}
+
+def _timestamps():
+    good = ['2011-08-31T12:%02d:%02d.%d+01:00' % (i // 60 % 60, i % 60, i) for i in range(1000)]
+    return {'events': [json_timestamp]}, {'events': good}, {'events': good[:-1] + ['yesterday']}
+
+def _formats():
+    # Few distinct values, as with IDs and enum-like fields
+    events = [
+        {'id': '%08x-d9cb-469f-a165-%012x' % (i % 20, i % 20), 'ts': '2011-08-31T12:00:%02d' % (i % 60)}
+        for i in range(1000)
+    ]
+    bad = events[:-1] + [{'id': 'not a uuid', 'ts': '2011-08-31T12:00:00'}]
+    return {'events': [{'id': format_uuid, 'ts': format_timestamp}]}, {'events': events}, {'events': bad}
+
+def _composed():
+    schema = required({'id': int})
+    for i in range(20):
+        schema = schema + (one_of if i % 2 else atleast_one)({'a%d' % i: int, 'b%d' % i: str})
+    good = {'id': 1}
+    for i in range(20):
+        good['a%d' % i] = i
+    bad = dict(good, b19='both')
+    return schema, good, bad
+
+CASES = [
+    ('flat', _flat),
+    ('deep', _deep),
+    ('int_list', _int_list),
+    ('list_of_dicts', _list_of_dicts),
+    ('timestamps', _timestamps),
+    ('formats', _formats),
+    ('composed', _composed),
+]
+
+ENGINES = [
+    ('do_validate', lambda schema: lambda client_json: do_validate(schema, client_json)),
+    ('compiled', lambda schema: compile_schema(schema).validate),
+    ('codegen', lambda schema: compile_schema(schema, codegen=True).validate),
+    ('iterative', lambda schema: functools.partial(validate_iterative, compile_schema(schema))),
+]
+
+
+def _run(validate, client_json, n):
+    for _ in range(n):
+        try:
+            validate(client_json)
+        except JSONException:
+            pass
+
+def _peak_objects(validate, client_json):
+    """
+    The most objects one operation has allocated and not yet freed at once,
+    counting those the garbage collector tracks:  with collection disabled,
+    its count of young objects goes up for each one allocated and down for
+    each one freed.  Sampled at each function call and return.
+    """
+    peak = [0]
+    def profile(frame, event, arg):
+        peak[0] = max(peak[0], gc.get_count()[0])
+
+    enabled = gc.isenabled()
+    gc.collect()
+    gc.disable()
+    base = gc.get_count()[0]
+    sys.setprofile(profile)
+    try:
+        _run(validate, client_json, 1)
+    finally:
+        sys.setprofile(None)
+        if enabled:
+            gc.enable()
+    return max(peak[0] - base, 0)
+
+def measure(validate, client_json, min_time, repeat=3):
+    """
+    @return:    (operations per second, peak objects allocated per operation,
+                peak bytes allocated per operation or None)
+    """
+    # Find a number of operations that takes at least min_time
+    n = 1
+    while True:
+        start = time.time()
+        _run(validate, client_json, n)
+        elapsed = time.time() - start
+        if elapsed >= min_time:
+            break
+        n *= 2
+
+    # The best of several runs is the least disturbed by other processes
+    for _ in range(repeat - 1):
+        start = time.time()
+        _run(validate, client_json, n)
+        elapsed = min(elapsed, time.time() - start)
+
+    ops = n / elapsed
+    peak_objects = _peak_objects(validate, client_json)
+    if tracemalloc is None:
+        return ops, peak_objects, None
+
+    tracemalloc.start()
+    try:
+        _run(validate, client_json, 1)
+        current, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return ops, peak_objects, peak
+
+def run(names=None, engines=None, min_time=0.2, repeat=3, out=sys.stdout):
+    """
+    @return:    Dict from benchmark name to {'ops': ops per second,
+                'peak_objects': peak objects allocated per operation,
+                'peak_bytes': peak bytes allocated per operation or None}
+    """
+    results = {}
+    for case, make in CASES:
+        if names and case not in names:
+            continue
+        schema, good, bad = make()
+        for engine, make_validate in ENGINES:
+            if engines and engine not in engines:
+                continue
+            validate = make_validate(schema)
+            for outcome, client_json in (('pass', good), ('fail', bad)):
+                name = '%s/%s/%s' % (case, engine, outcome)
+                ops, peak_objects, peak = measure(validate, client_json, min_time, repeat)
+                results[name] = {'ops': ops, 'peak_objects': peak_objects, 'peak_bytes': peak}
+                out.write('%-36s %12.1f ops/sec %8d objects %12s bytes peak\n' % (
+                    name, ops, peak_objects, '-' if peak is None else peak
+                ))
+                out.flush()
+    return results
+
+def compare(results, baseline, threshold, out=sys.stdout):
+    """
+    @return:    Names of the benchmarks that got slower by more than threshold
+                percent
+    """
+    regressions = []
+    for name in sorted(results):
+        if name not in baseline:
+            continue
+        change = 100.0 * (results[name]['ops'] - baseline[name]['ops']) / baseline[name]['ops']
+        flag = ''
+        if change < -threshold:
+            regressions.append(name)
+            flag = '  REGRESSION'
+        out.write('%-36s %+7.1f%%%s\n' % (name, change, flag))
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark json_validate')
+    parser.add_argument('names', nargs='*', help='benchmarks to run: %s' % ', '.join(case for case, make in CASES))
+    parser.add_argument('--engine', action='append', help='engines to run: %s' % ', '.join(engine for engine, make in ENGINES))
+    parser.add_argument('--min-time', type=float, default=0.2, help='seconds to run each benchmark')
+    parser.add_argument('--repeat', type=int, default=3, help='runs of each benchmark to take the best of')
+    parser.add_argument('--save', metavar='FILE', help='save results as a baseline')
+    parser.add_argument('--compare', metavar='FILE', help='compare results to a saved baseline')
+    parser.add_argument('--threshold', type=float, default=10.0, help='percent slowdown that counts as a regression')
+    args = parser.parse_args(argv)
+
+    results = run(args.names, args.engine, args.min_time, args.repeat)
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        sys.stdout.write('\n')
+        if compare(results, baseline, args.threshold):
+            return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,11 +1,38 @@
 import re
+import json
+import codecs
+import hashlib
+import collections
 import functools
 import operator
+import random
 import logging
+import threading
+import marshal
+import pickle
+import struct
+import os
+import sys
+import time
+
+from functools import reduce
+
+try:
+    unicode
+except NameError:
+    # Python 3
+    unicode = str
 
 class JSONException(Exception):
     pass
 
+class JSONLimitException(JSONException):
+    """
+    Client input is too large or too deeply nested to validate; see limits
+    and limited
+    """
+    pass
+
 # Matches dates like
 # 1997-07-16T19:20:30
 # or
@@ -21,6 +48,115 @@ json_timestamp = re.compile(r'\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2}(?P<ms>\.\d*)?(
 
 timestamp = int
 
+class json_format:
+    """
+    A string format check that can go anywhere a compiled regular expression
+    can in a json_structure:  match(value) is true if value is a string in
+    the format, and pattern describes the format in error messages.  Results
+    are cached by value, since the same IDs and enum-like values come up
+    over and over; wrap an expensive regular expression to cache it too, like
+    json_format(regex.pattern, regex.match).
+    @param pattern:     A regular expression for the format, for error
+                        messages
+    @param check:       Function from a string to True if it's in the format
+    @param cache_size:  Optional, the most results to cache
+    @param max_cached_length:   Optional, the longest value to cache the
+                                result for; longer ones are checked each
+                                time, so the cache can't grow huge
+    
+    >>> schema = compile_schema({'id': format_uuid, 'count': format_int_string})
+    >>> schema.validate({'id': '0f8fad5b-d9cb-469f-a165-70867728950e', 'count': '-12'})
+    >>> schema.validate({'id': '0f8fad5b-d9cb-469f-a165-70867728950e', 'count': '12.5'})
+    Traceback (most recent call last):
+        ...
+    JSONException: Format error:  client_json['count'] = '12.5', does not match required pattern '^-?[0-9]+$'
+    >>> hex_id = json_format(r'^[0-9a-f]+$', lambda value: not value.strip('0123456789abcdef'))
+    >>> hex_id.match('ab'), hex_id.match('ab' * 1000), len(hex_id.cache)
+    (True, True, 1)
+    """
+    def __init__(self, pattern, check, cache_size=1024, max_cached_length=256):
+        self.pattern = pattern
+        self.check = check
+        self.cache_size = cache_size
+        self.max_cached_length = max_cached_length
+        # {value: result}, emptied when it's full
+        self.cache = {}
+    
+    def match(self, value):
+        if not isinstance(value, (str, unicode)):
+            return False
+        if len(value) > self.max_cached_length:
+            return bool(self.check(value))
+        
+        result = self.cache.get(value)
+        if result is None:
+            result = bool(self.check(value))
+            if len(self.cache) >= self.cache_size:
+                self.cache.clear()
+            self.cache[value] = result
+        return result
+    
+    def __repr__(self):
+        return 'json_format(%s)' % repr(self.pattern)
+
+_digits = '0123456789'
+_hex_digits = '0123456789abcdefABCDEF'
+
+# Byte translation tables that turn each digit, or hex digit, into '0', so
+# that a fixed-width format can be checked with one comparison
+_digit_table = bytes(bytearray(ord('0') if chr(i) in _digits else i for i in range(256)))
+_hex_digit_table = bytes(bytearray(ord('0') if chr(i) in _hex_digits else i for i in range(256)))
+
+def _ascii(value):
+    try:
+        return value.encode('ascii')
+    except UnicodeError:
+        return None
+
+def _is_timestamp(value):
+    # Same as json_timestamp.match:  the fractional seconds and time zone are
+    # optional, and anything can follow
+    head = _ascii(value[:19])
+    return head is not None and head.translate(_digit_table) == b'0000-00-00T00:00:00'
+
+def _is_uuid(value):
+    value = _ascii(value) if len(value) == 36 else None
+    return value is not None and value.translate(_hex_digit_table) == b'00000000-0000-0000-0000-000000000000'
+
+def _is_int_string(value):
+    if value[:1] == '-':
+        value = value[1:]
+    return value != '' and not value.strip(_digits)
+
+# The characters \s matches in format_email's pattern:  all Unicode
+# whitespace on Python 3, and only ASCII whitespace on Python 2.  U+3000 is
+# the last whitespace character in Unicode; decoding every character up to it
+# at once is quicker than building them one by one.
+_whitespace = frozenset(re.findall(
+    r'\s', struct.pack('<%dI' % 0x3001, *range(0x3001)).decode('utf-32-le')
+))
+
+def _is_email(value):
+    # Something without spaces, an @, and a domain with a dot in it
+    local, at, domain = value.partition('@')
+    return (
+        local != '' and '@' not in domain and '.' in domain[1:-1]
+        and _whitespace.isdisjoint(value)
+    )
+
+def _is_hex_id(value):
+    return value != '' and not value.strip(_hex_digits)
+
+# Built-in formats.  Their checks take linear time, even on input that
+# makes a regular expression like format_email's backtrack.
+format_timestamp = json_format(json_timestamp.pattern, _is_timestamp)
+format_uuid = json_format(
+    r'^[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}$', _is_uuid
+)
+format_int_string = json_format(r'^-?[0-9]+$', _is_int_string)
+format_email = json_format(r'^[^@\s]+@[^@\s]+\.[^@\s]+$', _is_email)
+format_hex_id = json_format(r'^[0-9a-fA-F]+$', _is_hex_id)
+
 def assert_json(bvalue, msg):
     """
     Throw a JSONException if bvalue is False.
@@ -29,15 +165,98 @@ def assert_json(bvalue, msg):
     """
     if not bvalue: raise JSONException(msg)
 
+def _path_str(path):
+    """
+    Format a path built while validating.  To avoid formatting strings for
+    input that turns out to be valid, a path is either a string, or a tuple
+    (parent path, key or list index) that's only formatted on error.
+    @param path:    A string or tuple
+    >>> _path_str(((('client_json', 'a'), 0), u'b'))
+    "client_json['a'][0][u'b']"
+    """
+    root, keys = _path_keys(path)
+    return root + ''.join('[%s]' % repr(key) for key in keys)
+
+def _path_keys(path):
+    """
+    @param path:    A string or tuple, as for _path_str()
+    @return:        The root string, and a tuple of keys and list indexes
+    """
+    keys = []
+    while isinstance(path, tuple):
+        path, key = path
+        keys.append(key)
+    
+    keys.reverse()
+    return path, tuple(keys)
+
+def _is_json_type(t, value):
+    """
+    The test behind assert_json_type:  True if value is acceptable as type t
+    """
+    # Special case: 3.0 is acceptable as an int
+    if t is int and isinstance(value, float) and int(value) == value:
+        return True
+    
+    # Special case: ints acceptable as floats
+    elif t is float and isinstance(value, int):
+        return True
+    
+    # Special case: str and unicode interchangeable
+    elif t in (str, unicode) and (
+        isinstance(value, str) or isinstance(value, unicode)
+    ):
+        return True
+    
+    # Design decision: allow None for all scalar types
+    if value is None and t not in (dict, list, one_of, required):
+        return True
+    
+    return isinstance(value, t)
+
+def _exact_json_types(t):
+    """
+    The set of types whose instances _is_json_type(t, value) accepts without
+    any further test, for scanning many values at once.  Anything else, like
+    a float for t=int, still needs checking value by value.
+    """
+    if t is int:
+        return frozenset([int, bool, type(None)])
+    elif t is float:
+        return frozenset([float, int, bool, type(None)])
+    elif t in (str, unicode):
+        return frozenset([str, unicode, type(None)])
+    elif t in (dict, list):
+        return frozenset([t])
+    else:
+        return frozenset([t, type(None)])
+
+def _coerce_json_type(t, value):
+    """
+    Apply _is_json_type's special cases to a value of type t:  3.0 becomes
+    the int 3, ints become floats, and UTF-8 strs become unicode.
+    """
+    if t is int and isinstance(value, float):
+        return int(value)
+    elif t is float and type(value) is int:
+        return float(value)
+    elif t in (str, unicode) and isinstance(value, bytes):
+        try:
+            return value.decode('utf-8')
+        except UnicodeDecodeError:
+            # Valid input, just not text we can decode:  leave it alone
+            return value
+    return value
+
 def assert_json_type(t, value, path=''):
     """
     Throw JSONException if value is not of type t, or t is scalar type
     and value is None
     @param t:       A type like list, dict, str, int
     @param value:   The client value to test
-    @param path:    Optional string describing the path from the root of
-                    the JSON structure to the current node (supports
-                    recursion)
+    @param path:    Optional string or tuple describing the path from the
+                    root of the JSON structure to the current node (supports
+                    recursion); see _path_str()
     >>> assert_json_type(int, 1)
     >>> assert_json_type(float, 1)
     >>> assert_json_type(int, 1.0)
@@ -62,28 +281,10 @@ def assert_json_type(t, value, path=''):
     JSONException: Type error:  = None, which is of type NoneType.  A value of type dict is required
     >>> assert_json_type(1, None)
     """
-    # Special case: 3.0 is acceptable as an int
-    if t is int and isinstance(value, float) and int(value) == value:
-        return
-    
-    # Special case: ints acceptable as floats
-    elif t is float and isinstance(value, int):
-        return
-    
-    # Special case: str and unicode interchangeable
-    elif t in (str, unicode) and (
-        isinstance(value, str) or isinstance(value, unicode)
-    ):
-        return
-    
-    # Design decision: allow None for all scalar types
-    if value is None and t not in (dict, list, one_of, required):
-        return
-    
-    elif not isinstance(value, t):
+    if not _is_json_type(t, value):
         raise JSONException(
             'Type error: %s = %s, which is of type %s.  A value of type %s is required' % (
-                path, repr(value), type(value).__name__, t.__name__
+                _path_str(path), repr(value), type(value).__name__, t.__name__
             )
         )
 
@@ -101,7 +302,7 @@ class optional:
     >>> class C:
     ...     @json_validate({'foo':int, 'bar':optional(int)})
     ...     def fn(self, input):
-    ...         print input
+    ...         print(input)
     ... 
     >>> c = C()
     >>> c.fn({'foo':1,'bar':1})
@@ -119,6 +320,26 @@ class optional:
     def __repr__(self):
         return "optional(%s)" % self.value
 
+class limited:
+    """
+    A portion of a JSON structure whose list or string value can be at most
+    max_length long.  The length is checked first, so a huge value is
+    rejected without validating its elements or matching a regular expression
+    against it.
+    >>> schema = compile_schema({'ids': limited([int], 3), 'name': limited(re.compile('^[a-z]+$'), 8)})
+    >>> schema.validate({'ids': [1, 2, 3], 'name': 'abc'})
+    >>> schema.validate({'ids': [1, 2, 3], 'name': 'a' * 1000000})
+    Traceback (most recent call last):
+        ...
+    JSONLimitException: Limit error:  client_json['name'] exceeds max_length = 8
+    """
+    def __init__(self, value, max_length):
+        self.value = value
+        self.max_length = max_length
+    
+    def __repr__(self):
+        return "limited(%s, %s)" % (self.value, self.max_length)
+
 
 class json_validator_wrapper:
     """
@@ -132,6 +353,76 @@ class json_validator_wrapper:
         """
         self.json_structure = json_structure
         self.addends = addends
+        
+        # Every dict wrapped by self and the addends, and their keys when the
+        # index was built
+        self._dicts = [json_structure] + [d for addend in addends for d in addend._dicts]
+        self._flatten()
+    
+    def _flatten(self):
+        """
+        Flatten self and the addends into one index from key to the dict that
+        holds it, so lookups don't walk the addends, and compute the key
+        groups.
+        """
+        for addend in self.addends:
+            addend._refresh()
+        self._keys = [frozenset(d) for d in self._dicts]
+        
+        self.index = dict((key, self.json_structure) for key in self.json_structure)
+        for addend in self.addends:
+            for key in addend.index:
+                if key in self.index:
+                    raise ValueError('key %s appears more than once in json_structure' % repr(key))
+            self.index.update(addend.index)
+        
+        # My keys plus those of any addends
+        if isinstance(self, (atleast_one, one_of)):
+            my_keys = []
+        elif isinstance(self, required) or isinstance(self.json_structure, dict):
+            my_keys = self.json_structure.keys()
+        else:
+            my_keys = []
+        
+        self._required_keys = list(
+            set(my_keys).union(
+                reduce(
+                    operator.add, [
+                        addend._required_keys for addend in self.addends
+                    ], []
+                )
+            )
+        )
+        
+        self._one_of_keys = [list(self.json_structure.keys())] if isinstance(self, one_of) else []
+        self._atleast_one_keys = [list(self.json_structure.keys())] if isinstance(self, atleast_one) else []
+        for addend in self.addends:
+            self._one_of_keys.extend(addend._one_of_keys)
+            self._atleast_one_keys.extend(addend._atleast_one_keys)
+    
+    def _refresh(self):
+        """
+        Flatten again if keys were added to or removed from a wrapped dict
+        since the index was built, e.g. to make a structure contain itself.
+        
+        >>> d = {'a': int}
+        >>> w = required(d) + one_of({'b': int, 'c': int})
+        >>> d['d'] = str
+        >>> do_validate(w, {'a': 1, 'b': 2, 'd': 3})
+        Traceback (most recent call last):
+            ...
+        JSONException: Type error: client_json['d'] = 3, which is of type int.  A value of type str is required
+        >>> del d['a']
+        >>> d['x'] = str
+        >>> do_validate(w, {'b': 2, 'd': 'foo'})
+        Traceback (most recent call last):
+            ...
+        JSONException: Key error:  missing key client_json['x']
+        """
+        for d, keys in zip(self._dicts, self._keys):
+            if len(d) != len(keys) or not keys.issuperset(d):
+                self._flatten()
+                return
     
     def __add__(self, other):
         """
@@ -150,9 +441,11 @@ class json_validator_wrapper:
         Traceback (most recent call last):
             ...
         JSONException: Type error: client_json['a'] = 'wrong, this is a string', which is of type str.  A value of type int is required
+        >>> sum + {'a':float}
+        Traceback (most recent call last):
+            ...
+        ValueError: key 'a' appears more than once in json_structure
         """
-        # TODO: ensure addends share no keys with self.json_structure
-        
         if not isinstance(other, json_validator_wrapper):
             # Treat Python dicts as 'required' instances
             other = required(other)
@@ -168,46 +461,20 @@ class json_validator_wrapper:
         >>> w.required_keys()
         ['a']
         """
-        if isinstance(self, (atleast_one, one_of)):
-            my_keys = []
-        # My one_of keys plus those of any addends
-        elif isinstance(self, required) or isinstance(self.json_structure, dict):
-            my_keys = self.json_structure.keys()
-        else:
-            my_keys = []
-        
-        return list(
-            set(my_keys).union(
-                reduce(
-                    operator.add, [
-                        addend.required_keys() for addend in self.addends
-                    ], []
-                )
-            )
-        )
+        self._refresh()
+        return list(self._required_keys)
         
     def one_of_keys(self):
         """
         @return:    List of lists of one_of keys.  Client JSON object must contain
                     exactly one key in each list.
         """
-        rv = [self.json_structure.keys()] if isinstance(self, one_of) else []
-        
-        for addend in self.addends:
-            addend_one_of_keys = addend.one_of_keys()
-            if addend_one_of_keys:
-                rv.extend(addend_one_of_keys)
-        
-        return rv
+        self._refresh()
+        return list(self._one_of_keys)
 
     def atleast_one_keys(self):
-        ret = [self.json_structure.keys()] if isinstance(self, atleast_one) else []
-        
-        for addend in self.addends:
-            more = addend.atleast_one_keys()
-            if more: ret.extend(more)
-
-        return ret
+        self._refresh()
+        return list(self._atleast_one_keys)
     
     def __getitem__(self, k):
         """
@@ -215,17 +482,12 @@ class json_validator_wrapper:
         >>> (one_of({'a':int, 'b':int}) + required({'c':str}))['c']
         <type 'str'>
         """
-        if k in self.json_structure:
-            return self.json_structure[k]
-        else:
-            for addend in self.addends:
-                try:
-                    return addend[k]
-                except KeyError:
-                    pass
-        
-        # Not in self or any addends
-        raise KeyError(k)
+        try:
+            return self.index[k][k]
+        except KeyError:
+            # Maybe the wrapped dicts changed since they were flattened
+            self._refresh()
+            return self.index[k][k]
 
 
 class one_of(json_validator_wrapper):
@@ -270,6 +532,67 @@ class required(json_validator_wrapper):
     """
     pass
 
+class tagged_union:
+    """
+    Validates a JSON object whose structure depends on the value of one of its
+    keys, the tag.  E.g., if you have a function like:
+    
+    @json_validate(tagged_union('type', {
+        'click': {'x': int, 'y': int},
+        'view': {'url': str},
+    }))
+    def handle_event():
+        pass
+    
+    Then you can call handle_event({'type': 'click', 'x': 1, 'y': 2}) or
+    handle_event({'type': 'view', 'url': '/'}), but not
+    handle_event({'type': 'view', 'x': 1, 'y': 2}).  The structure for the tag
+    value is found with one dict lookup, however many variants there are.
+    
+    >>> schema = compile_schema(tagged_union('type', {
+    ...     'click': {'x': int, 'y': int},
+    ...     'view': {'url': str},
+    ... }))
+    >>> schema.validate({'type': 'click', 'x': 1, 'y': 2})
+    >>> schema.validate({'type': 'view', 'x': 1, 'y': 2})
+    Traceback (most recent call last):
+        ...
+    JSONException: Key error:  missing key client_json['url']
+    >>> schema.validate({'type': 'scroll'})
+    Traceback (most recent call last):
+        ...
+    JSONException: Tag error:  client_json['type'] = 'scroll', which is not one of: ['click', 'view']
+    >>> tree = {'name': str}
+    >>> tree['children'] = [tagged_union('type', {'tree': tree, 'leaf': {'value': int}})]
+    >>> compile_schema(tree, codegen=True).validate({'name': 'root', 'children': [
+    ...     {'type': 'tree', 'name': 'branch', 'children': [{'type': 'leaf', 'value': 'one'}]},
+    ... ]})
+    Traceback (most recent call last):
+        ...
+    JSONException: Type error: client_json['children'][0]['children'][0]['value'] = 'one', which is of type str.  A value of type int is required
+    """
+    def __init__(self, tag, variants):
+        """
+        @param tag:         The key whose value selects a variant
+        @param variants:    A dict from tag values to json_structures
+        """
+        self.tag = tag
+        self.variants = variants
+        self.tags = sorted(variants.keys())
+    
+    def variant(self, value):
+        """
+        @return:    The json_structure for a tag value, or None
+        """
+        try:
+            return self.variants.get(value)
+        except TypeError:
+            # Unhashable value, like a list
+            return None
+    
+    def __repr__(self):
+        return "tagged_union(%s, %s)" % (repr(self.tag), repr(self.variants))
+
 
 def do_validate(json_structure, client_json, path='client_json'):
     """
@@ -277,9 +600,9 @@ def do_validate(json_structure, client_json, path='client_json'):
     @param json_structure:  An example json object, the kind of input the wrapped
                             function requires.
     @param client_json:     An object passed in from a client
-    @param path:           Optional string describing the path from the root of
-                            the JSON structure to the current node (supports
-                            recursion)
+    @param path:            Optional string or tuple describing the path from
+                            the root of the JSON structure to the current node
+                            (supports recursion); see _path_str()
     """
     # Watch the order of these if-statements, check for derived classes before
     # base classes.
@@ -291,14 +614,15 @@ def do_validate(json_structure, client_json, path='client_json'):
             # Get the value for key from the wrapped JSON structure
             next_json_structure = json_structure[key]
             if not isinstance(next_json_structure, optional):
-                assert_json(key in client_json, "Key error:  missing key %s[%s]" % (
-                    path, repr(key)
-                ))
+                if key not in client_json:
+                    raise JSONException("Key error:  missing key %s[%s]" % (
+                        _path_str(path), repr(key)
+                    ))
                 
-                do_validate(next_json_structure, client_json[key], path + '[%s]' % repr(key))
+                do_validate(next_json_structure, client_json[key], (path, key))
             
             elif key in client_json:
-                do_validate(next_json_structure, client_json[key], path + '[%s]' % repr(key))
+                do_validate(next_json_structure, client_json[key], (path, key))
         
         # Validate all one_of keys.  They're formatted as a list of lists of keys.
         for one_of_keys in json_structure.one_of_keys():
@@ -309,17 +633,17 @@ def do_validate(json_structure, client_json, path='client_json'):
             
             if len(keys_in_client_json) == 0:
                 raise JSONException("%s requires one of these keys, but found none: %s" % (
-                    path, one_of_keys
+                    _path_str(path), one_of_keys
                 ))
             elif len(keys_in_client_json) > 1:
                 raise JSONException("%s requires one of these keys: %s, but found several: %s" % (
-                    path, one_of_keys, keys_in_client_json
+                    _path_str(path), one_of_keys, keys_in_client_json
                 ))
             
             key = keys_in_client_json[0]
             # Get the value for key from the wrapped JSON structure
             next_json_structure = json_structure[key]
-            do_validate(next_json_structure, client_json[key], path + '[%s]' % repr(key))
+            do_validate(next_json_structure, client_json[key], (path, key))
 
         for atleast_one_keys in json_structure.atleast_one_keys():
             keys_in_client_json = [
@@ -329,13 +653,13 @@ def do_validate(json_structure, client_json, path='client_json'):
             
             if len(keys_in_client_json) == 0:
                 raise JSONException("%s requires *at least* one of these keys, but found none: %s" % (
-                    path, atleast_one_keys
+                    _path_str(path), atleast_one_keys
                 ))
             
             key = keys_in_client_json[0]
             # Get the value for key from the wrapped JSON structure
             next_json_structure = json_structure[key]
-            do_validate(next_json_structure, client_json[key], path + '[%s]' % repr(key))
+            do_validate(next_json_structure, client_json[key], (path, key))
     
     elif isinstance(json_structure, dict):
         # Treat regular Python dicts the same as 'required' instances
@@ -346,7 +670,7 @@ def do_validate(json_structure, client_json, path='client_json'):
         assert_json_type(list, client_json, path)
         assert len(json_structure) == 1, "lists in json_validate structures must have exactly one element"
         for i, client_value in enumerate(client_json):
-            do_validate(json_structure[0], client_value, path + '[%s]' % i)
+            do_validate(json_structure[0], client_value, (path, i))
     
     elif isinstance(json_structure, optional):
         # OK if client_json is falsy
@@ -354,6 +678,26 @@ def do_validate(json_structure, client_json, path='client_json'):
             # Validate the optional value
             do_validate(json_structure.value, client_json, path)
     
+    elif isinstance(json_structure, limited):
+        max_length = json_structure.max_length
+        if isinstance(client_json, (list, str, unicode)) and len(client_json) > max_length:
+            raise validation_error('limit', path, ('max_length', max_length), len(client_json)).exception()
+        do_validate(json_structure.value, client_json, path)
+    
+    elif isinstance(json_structure, tagged_union):
+        assert_json_type(dict, client_json, path)
+        tag = json_structure.tag
+        if tag not in client_json:
+            raise JSONException("Key error:  missing key %s[%s]" % (
+                _path_str(path), repr(tag)
+            ))
+        
+        next_json_structure = json_structure.variant(client_json[tag])
+        if next_json_structure is None:
+            raise validation_error('tag', (path, tag), json_structure.tags, client_json[tag]).exception()
+        
+        do_validate(next_json_structure, client_json, path)
+    
     elif json_structure == anytype:
         # client_json can be anything, including None -- we already know it's present
         pass
@@ -365,79 +709,2742 @@ def do_validate(json_structure, client_json, path='client_json'):
         
     elif hasattr(json_structure, 'match'):
         # json_structure is a compiled regular expression
-        assert_json(
-            json_structure.match(client_json),
-            'Format error:  %s = %s, does not match required pattern %s' % (
-                path, repr(client_json), repr(json_structure.pattern)
-            )
-        )
+        if not json_structure.match(client_json):
+            raise JSONException('Format error:  %s = %s, does not match required pattern %s' % (
+                _path_str(path), repr(client_json), repr(json_structure.pattern)
+            ))
     else:
         raise TypeError('json_structure argument %s is of prohibited type' % repr(json_structure))
 
 
-def json_validate(json_structure):
+class validation_error:
     """
-    Generalize a way to validate JSON fields.  The json_structure parameter is
-    a description of the kind of client input the wrapped function requires.
-    The json_structure allowed values are <type 'int'>, <type 'float'>,
-    <type 'str'>, a list, a dict, or a compiled regular expression.  If
-    json_structure is a list or dict, each of its members must also be one of
-    the allowed values, and so on recursively.
+    Describes why client input failed to validate, without formatting
+    anything:  str(error) renders the same message the JSONException would
+    have, and error.exception() makes that JSONException.
     
-    The wrapper will throw a JSONException if the client-input JSON
-    does not have a structure that matches json_structure.  Ergo:
+    @ivar path:     Tuple of keys and list indexes from the root of the client
+                    input to the invalid value
+    @ivar kind:     One of 'type', 'format', 'missing_key', 'one_of_none',
+                    'one_of_several', 'atleast_one_none', 'tag', 'depth',
+                    'limit'
+    @ivar expected: What the structure required:  a type, a compiled regular
+                    expression, the missing key's structure, a list of keys
+                    or tag values, the maximum depth, or for 'limit', the
+                    limit's name and value
+    @ivar value:    The invalid client value, for 'one_of_several', the keys
+                    that were found, or for 'limit', the size found
+    """
+    def __init__(self, kind, path, expected, value=None):
+        self.kind = kind
+        self.root, self.path = _path_keys(path)
+        self.expected = expected
+        self.value = value
+    
+    def path_str(self):
+        return self.root + ''.join('[%s]' % repr(key) for key in self.path)
+    
+    def schema_path(self):
+        """
+        The path with list indexes as [*], like enable_validation_stats()'s
+        schema paths
+        """
+        return self.root + ''.join(
+            '[*]' if isinstance(key, int) else '[%s]' % repr(key) for key in self.path
+        )
+    
+    def __str__(self):
+        if self.kind == 'type':
+            return 'Type error: %s = %s, which is of type %s.  A value of type %s is required' % (
+                self.path_str(), repr(self.value), type(self.value).__name__, self.expected.__name__
+            )
+        elif self.kind == 'format':
+            return 'Format error:  %s = %s, does not match required pattern %s' % (
+                self.path_str(), repr(self.value), repr(self.expected.pattern)
+            )
+        elif self.kind == 'missing_key':
+            return "Key error:  missing key %s" % self.path_str()
+        elif self.kind == 'one_of_none':
+            return "%s requires one of these keys, but found none: %s" % (
+                self.path_str(), self.expected
+            )
+        elif self.kind == 'one_of_several':
+            return "%s requires one of these keys: %s, but found several: %s" % (
+                self.path_str(), self.expected, self.value
+            )
+        elif self.kind == 'atleast_one_none':
+            return "%s requires *at least* one of these keys, but found none: %s" % (
+                self.path_str(), self.expected
+            )
+        elif self.kind == 'tag':
+            return "Tag error:  %s = %s, which is not one of: %s" % (
+                self.path_str(), repr(self.value), self.expected
+            )
+        elif self.kind == 'depth':
+            return "Depth error:  %s is nested more than %s levels deep" % (
+                self.path_str(), self.expected
+            )
+        elif self.kind == 'limit':
+            return "Limit error:  %s exceeds %s = %s" % (
+                self.path_str(), self.expected[0], self.expected[1]
+            )
+        else:
+            return '%s error: %s' % (self.kind, self.path_str())
+    
+    def __repr__(self):
+        return '<validation_error %s>' % str(self)
+    
+    def exception(self):
+        if self.kind in ('depth', 'limit'):
+            e = JSONLimitException(str(self))
+        else:
+            e = JSONException(str(self))
+        e.validation_error = self
+        return e
 
-    If json_structure is <type 'str'>, client input must be a string or unicode.
 
-    If json_structure is <type 'int'>, client input must be an int, or a float
-    with no fractional part.
+class _compiled_node:
+    """
+    Base class for the nodes compile_schema() returns.  Subclasses implement
+    check(client_json, path), which returns a validation_error or None.
+    Nodes with child nodes also implement children(client_json, path); see
+    check_iterative().  project(client_json, path, coerce) checks like
+    check() and builds validate_project()'s copy at the same time, returning
+    (validation_error or None, copy).
+    check_changed(client_json, path, changes) checks like check(), but only
+    where changes says client_json changed; see check_changed().
+    """
+    children = None
     
-    If json_structure is <type 'float'>, client input must be an int or a float.
+    def check_changed(self, client_json, path, changes):
+        # Nothing to skip in a value without child values
+        return self.check(client_json, path)
     
-    If json_structure is a compiled regular expression, client input must be a
-    matching string.  (Remember to end your regex with '$'.)
+    def validate(self, client_json, path='client_json'):
+        """
+        Throw a JSONException if client_json doesn't validate
+        """
+        error = self.check(client_json, path)
+        if error is not None:
+            raise error.exception()
+
+class _object_node(_compiled_node):
+    """
+    Compiled form of a dict or json_validator_wrapper:  the required, one_of
+    and atleast_one key groups are computed once, and each key's value is
+    already compiled.
+    """
+    def __init__(self, json_structure, memo):
+        memo[id(json_structure)] = self
+        if not isinstance(json_structure, json_validator_wrapper):
+            # Treat regular Python dicts the same as 'required' instances
+            json_structure = required(json_structure)
+        
+        self.json_structure = json_structure
+        
+        # List of (key, compiled value, is optional)
+        self.required = []
+        for key in json_structure.required_keys():
+            next_json_structure = json_structure[key]
+            self.required.append((
+                key, _compile(next_json_structure, memo),
+                isinstance(next_json_structure, optional)
+            ))
+        
+        # Lists of (keys, {key: compiled value}, {key: position in keys})
+        self.one_of = [
+            self._compile_keys(keys, memo)
+            for keys in json_structure.one_of_keys()
+        ]
+        self.atleast_one = [
+            self._compile_keys(keys, memo)
+            for keys in json_structure.atleast_one_keys()
+        ]
+        
+        # Every key in the structure
+        self.key_nodes = dict((key, node) for key, node, is_optional in self.required)
+        for keys, nodes, positions in self.one_of + self.atleast_one:
+            self.key_nodes.update(nodes)
     
-    If json_structure is a list with one member, client input must be a list of
-    zero or more members, each client-input member matching the json_structure
-    member.
+    def _compile_keys(self, keys, memo):
+        return (
+            keys,
+            dict((key, _compile(self.json_structure[key], memo)) for key in keys),
+            dict((key, i) for i, key in enumerate(keys))
+        )
     
-    If json_structure is a dict, client input must be a dict (a JSON 'object')
-    with the all the keys json_structure has, and its values must match the
-    corresponding json_structure values.  The validator ignores extra keys in
-    client input.
+    def _keys_in(self, keys, positions, client_json):
+        """
+        The keys that are in client_json, in the same order as keys, looking
+        through whichever of keys and client_json is shorter.  These are
+        always the schema's own keys, not client_json's, which may be unicode
+        where the schema's are str.
+        """
+        if len(keys) <= len(client_json):
+            return [key for key in keys if key in client_json]
+        
+        found = [keys[positions[key]] for key in client_json if key in positions]
+        found.sort(key=positions.__getitem__)
+        return found
     
-    @param json_structure:  An example json object, the kind of input the wrapped
-                            function requires.
-
-    >>> json_structure = required({'must_be_here':str}) + {
-    ...     'a': int,
-    ...     'b': float,
-    ...     'c': str,
-    ...     'd': [int],
-    ...     'e': anytype,
-    ...     'f': {'nested_structure': float},
-    ...     'g': re.compile('^fo*$'),
-    ...     'h': one_of({'a': int, 'b': list}),
-    ...     'i': atleast_one({'a': int, 'b': list}),
-    ... } + atleast_one({'more_keys': str})
-    >>> class C:
-    ...     @json_validate(json_structure)
-    ...     def fn(self, input):
-    ...         print input
-    ... 
-    >>> c = C()
-    >>> c.fn({
-    ...     'must_be_here': 'is here',
-    ...     'a': 1.0,
-    ...     'b': 2.5,
-    ...     'c': 'Hi!',
-    ...     'd': [1, 2, 3],
-    ...     'e': [],
-    ...     'f': {'nested_structure': 5},
-    ...     'extra_key': 'this is ignored by json_validate',
-    ...     'g': 'fooooooooo',
-    ...     'h': {'b':['anything','is','OK','here']},
-    ...     'i': {'a':1},
+    def check(self, client_json, path='client_json'):
+        if not isinstance(client_json, dict):
+            return validation_error('type', path, dict, client_json)
+        
+        for key, node, is_optional in self.required:
+            if key in client_json:
+                error = node.check(client_json[key], (path, key))
+                if error is not None:
+                    return error
+            elif not is_optional:
+                return validation_error('missing_key', (path, key), node.json_structure)
+        
+        for one_of_keys, nodes, positions in self.one_of:
+            keys_in_client_json = self._keys_in(one_of_keys, positions, client_json)
+            
+            if len(keys_in_client_json) == 0:
+                return validation_error('one_of_none', path, one_of_keys)
+            elif len(keys_in_client_json) > 1:
+                return validation_error('one_of_several', path, one_of_keys, keys_in_client_json)
+            
+            key = keys_in_client_json[0]
+            error = nodes[key].check(client_json[key], (path, key))
+            if error is not None:
+                return error
+        
+        for atleast_one_keys, nodes, positions in self.atleast_one:
+            keys_in_client_json = self._keys_in(atleast_one_keys, positions, client_json)
+            
+            if len(keys_in_client_json) == 0:
+                return validation_error('atleast_one_none', path, atleast_one_keys)
+            
+            key = keys_in_client_json[0]
+            error = nodes[key].check(client_json[key], (path, key))
+            if error is not None:
+                return error
+    
+    def check_changed(self, client_json, path, changes):
+        if not isinstance(client_json, dict):
+            return validation_error('type', path, dict, client_json)
+        
+        for key, node, is_optional in self.required:
+            if key in client_json:
+                error = _check_changed(node, client_json[key], (path, key), changes.get(key))
+                if error is not None:
+                    return error
+            elif not is_optional:
+                return validation_error('missing_key', (path, key), node.json_structure)
+        
+        for one_of_keys, nodes, positions in self.one_of:
+            keys_in_client_json = self._keys_in(one_of_keys, positions, client_json)
+            
+            if len(keys_in_client_json) == 0:
+                return validation_error('one_of_none', path, one_of_keys)
+            elif len(keys_in_client_json) > 1:
+                return validation_error('one_of_several', path, one_of_keys, keys_in_client_json)
+            
+            key = keys_in_client_json[0]
+            error = _check_changed(nodes[key], client_json[key], (path, key), self._group_changes(one_of_keys, key, changes))
+            if error is not None:
+                return error
+        
+        for atleast_one_keys, nodes, positions in self.atleast_one:
+            keys_in_client_json = self._keys_in(atleast_one_keys, positions, client_json)
+            
+            if len(keys_in_client_json) == 0:
+                return validation_error('atleast_one_none', path, atleast_one_keys)
+            
+            key = keys_in_client_json[0]
+            error = _check_changed(nodes[key], client_json[key], (path, key), self._group_changes(atleast_one_keys, key, changes))
+            if error is not None:
+                return error
+    
+    def _group_changes(self, keys, key, changes):
+        """
+        The changes to check the value at key with, key being the one of keys
+        that check() validates.  If any of keys was added or removed, key may
+        not have been the one validated before, so check all of it.
+        """
+        for other_key in keys:
+            if changes.get(other_key) is True:
+                return True
+        return changes.get(key)
+    
+    def project(self, client_json, path, coerce):
+        if not isinstance(client_json, dict):
+            return validation_error('type', path, dict, client_json), None
+        
+        result = {}
+        for key, node, is_optional in self.required:
+            if key in client_json:
+                error, result[key] = node.project(client_json[key], (path, key), coerce)
+                if error is not None:
+                    return error, None
+            elif not is_optional:
+                return validation_error('missing_key', (path, key), node.json_structure), None
+        
+        for one_of_keys, nodes, positions in self.one_of:
+            keys_in_client_json = self._keys_in(one_of_keys, positions, client_json)
+            
+            if len(keys_in_client_json) == 0:
+                return validation_error('one_of_none', path, one_of_keys), None
+            elif len(keys_in_client_json) > 1:
+                return validation_error('one_of_several', path, one_of_keys, keys_in_client_json), None
+            
+            key = keys_in_client_json[0]
+            error, result[key] = nodes[key].project(client_json[key], (path, key), coerce)
+            if error is not None:
+                return error, None
+        
+        for atleast_one_keys, nodes, positions in self.atleast_one:
+            keys_in_client_json = self._keys_in(atleast_one_keys, positions, client_json)
+            
+            if len(keys_in_client_json) == 0:
+                return validation_error('atleast_one_none', path, atleast_one_keys), None
+            
+            key = keys_in_client_json[0]
+            error, result[key] = nodes[key].project(client_json[key], (path, key), coerce)
+            if error is not None:
+                return error, None
+            
+            # Only the first key is validated; keep the others as they are
+            for key in keys_in_client_json[1:]:
+                result[key] = client_json[key]
+        
+        return None, result
+    
+    def children(self, client_json, path):
+        # Like check(), but yields the child nodes to check instead of
+        # recursing; see check_iterative()
+        if not isinstance(client_json, dict):
+            yield validation_error('type', path, dict, client_json)
+            return
+        
+        for key, node, is_optional in self.required:
+            if key in client_json:
+                yield node, client_json[key], (path, key)
+            elif not is_optional:
+                yield validation_error('missing_key', (path, key), node.json_structure)
+                return
+        
+        for one_of_keys, nodes, positions in self.one_of:
+            keys_in_client_json = self._keys_in(one_of_keys, positions, client_json)
+            
+            if len(keys_in_client_json) == 0:
+                yield validation_error('one_of_none', path, one_of_keys)
+                return
+            elif len(keys_in_client_json) > 1:
+                yield validation_error('one_of_several', path, one_of_keys, keys_in_client_json)
+                return
+            
+            key = keys_in_client_json[0]
+            yield nodes[key], client_json[key], (path, key)
+        
+        for atleast_one_keys, nodes, positions in self.atleast_one:
+            keys_in_client_json = self._keys_in(atleast_one_keys, positions, client_json)
+            
+            if len(keys_in_client_json) == 0:
+                yield validation_error('atleast_one_none', path, atleast_one_keys)
+                return
+            
+            key = keys_in_client_json[0]
+            yield nodes[key], client_json[key], (path, key)
+
+class _list_node(_compiled_node):
+    def __init__(self, json_structure, memo):
+        assert len(json_structure) == 1, "lists in json_validate structures must have exactly one element"
+        memo[id(json_structure)] = self
+        self.json_structure = json_structure
+        self.element = _compile(json_structure[0], memo)
+        self._scan_types()
+    
+    def _scan_types(self):
+        # For lists like [int], check all the elements' types in one scan
+        if isinstance(self.element, _type_node):
+            self.exact_types = _exact_json_types(self.element.json_structure)
+            # The same, for project() when it coerces:  leave out the types
+            # _coerce_json_type() would change
+            if self.element.json_structure is int:
+                self.uncoerced_types = self.exact_types
+            else:
+                self.uncoerced_types = self.exact_types - frozenset([int, str])
+        else:
+            self.exact_types = self.uncoerced_types = None
+    
+    def __getstate__(self):
+        # Python 2 can't pickle type(None), e.g. for validate_many(), so the
+        # type sets are rebuilt instead
+        state = dict(self.__dict__)
+        del state['exact_types'], state['uncoerced_types']
+        return state
+    
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._scan_types()
+    
+    def check(self, client_json, path='client_json'):
+        # We expect client_json to be a list:  any number of elements in client_json is ok
+        if not isinstance(client_json, list):
+            return validation_error('type', path, list, client_json)
+        
+        if self.exact_types is not None and self.exact_types.issuperset(map(type, client_json)):
+            return
+        
+        # Check one by one, for values like 3.0 in an [int] or to find the
+        # invalid element
+        check_element = self.element.check
+        for i, client_value in enumerate(client_json):
+            error = check_element(client_value, (path, i))
+            if error is not None:
+                return error
+    
+    def check_changed(self, client_json, path, changes):
+        if not isinstance(client_json, list):
+            return validation_error('type', path, list, client_json)
+        
+        # Check the changed elements in order, like check() would
+        indexes = {}
+        for key, index_changes in changes.items():
+            index = _list_index(client_json, key)
+            if index is not None and indexes.get(index) is not True:
+                indexes[index] = index_changes
+        
+        element = self.element
+        for index in sorted(indexes):
+            error = _check_changed(element, client_json[index], (path, index), indexes[index])
+            if error is not None:
+                return error
+    
+    def project(self, client_json, path, coerce):
+        if not isinstance(client_json, list):
+            return validation_error('type', path, list, client_json), None
+        
+        exact_types = self.uncoerced_types if coerce else self.exact_types
+        if exact_types is not None and exact_types.issuperset(map(type, client_json)):
+            return None, list(client_json)
+        
+        result = []
+        project_element = self.element.project
+        for i, client_value in enumerate(client_json):
+            error, value = project_element(client_value, (path, i), coerce)
+            if error is not None:
+                return error, None
+            result.append(value)
+        return None, result
+    
+    def children(self, client_json, path):
+        if not isinstance(client_json, list):
+            yield validation_error('type', path, list, client_json)
+            return
+        
+        if self.exact_types is not None and self.exact_types.issuperset(map(type, client_json)):
+            return
+        
+        element = self.element
+        for i, client_value in enumerate(client_json):
+            yield element, client_value, (path, i)
+
+class _optional_node(_compiled_node):
+    def __init__(self, json_structure, memo):
+        memo[id(json_structure)] = self
+        self.json_structure = json_structure
+        self.value = _compile(json_structure.value, memo)
+    
+    def check(self, client_json, path='client_json'):
+        # OK if client_json is falsy
+        if client_json:
+            return self.value.check(client_json, path)
+    
+    def check_changed(self, client_json, path, changes):
+        if client_json:
+            return self.value.check_changed(client_json, path, changes)
+    
+    def project(self, client_json, path, coerce):
+        if client_json:
+            return self.value.project(client_json, path, coerce)
+        return None, client_json
+    
+    def children(self, client_json, path):
+        if client_json:
+            yield self.value, client_json, path
+
+class _limited_node(_compiled_node):
+    def __init__(self, json_structure, memo):
+        memo[id(json_structure)] = self
+        self.json_structure = json_structure
+        self.max_length = json_structure.max_length
+        self.value = _compile(json_structure.value, memo)
+    
+    def check_length(self, client_json, path):
+        if isinstance(client_json, (list, str, unicode)) and len(client_json) > self.max_length:
+            return validation_error('limit', path, ('max_length', self.max_length), len(client_json))
+    
+    def check(self, client_json, path='client_json'):
+        error = self.check_length(client_json, path)
+        if error is not None:
+            return error
+        return self.value.check(client_json, path)
+    
+    def children(self, client_json, path):
+        error = self.check_length(client_json, path)
+        if error is not None:
+            yield error
+        else:
+            yield self.value, client_json, path
+    
+    def check_changed(self, client_json, path, changes):
+        error = self.check_length(client_json, path)
+        if error is not None:
+            return error
+        return self.value.check_changed(client_json, path, changes)
+    
+    def project(self, client_json, path, coerce):
+        error = self.check_length(client_json, path)
+        if error is not None:
+            return error, None
+        return self.value.project(client_json, path, coerce)
+
+class _tagged_union_node(_compiled_node):
+    def __init__(self, json_structure, memo):
+        memo[id(json_structure)] = self
+        self.json_structure = json_structure
+        self.tag = json_structure.tag
+        self.variants = dict(
+            (value, _compile(variant, memo))
+            for value, variant in json_structure.variants.items()
+        )
+    
+    def check_tag(self, client_json, path):
+        """
+        Check that client_json is a dict with a known tag value
+        """
+        if not isinstance(client_json, dict):
+            return validation_error('type', path, dict, client_json)
+        
+        tag = self.tag
+        if tag not in client_json:
+            return validation_error('missing_key', (path, tag), self.json_structure.tags)
+        
+        try:
+            known = client_json[tag] in self.variants
+        except TypeError:
+            # Unhashable value, like a list
+            known = False
+        
+        if not known:
+            return validation_error('tag', (path, tag), self.json_structure.tags, client_json[tag])
+    
+    def check(self, client_json, path='client_json'):
+        error = self.check_tag(client_json, path)
+        if error is not None:
+            return error
+        return self.variants[client_json[self.tag]].check(client_json, path)
+    
+    def check_changed(self, client_json, path, changes):
+        error = self.check_tag(client_json, path)
+        if error is not None:
+            return error
+        
+        # A new tag means a different variant
+        if changes.get(self.tag) is True:
+            changes = True
+        return _check_changed(self.variants[client_json[self.tag]], client_json, path, changes)
+    
+    def project(self, client_json, path, coerce):
+        error = self.check_tag(client_json, path)
+        if error is not None:
+            return error, None
+        
+        tag = client_json[self.tag]
+        error, result = self.variants[tag].project(client_json, path, coerce)
+        if error is None and isinstance(result, dict):
+            result[self.tag] = tag
+        return error, result
+    
+    def children(self, client_json, path):
+        error = self.check_tag(client_json, path)
+        if error is not None:
+            yield error
+        else:
+            yield self.variants[client_json[self.tag]], client_json, path
+
+class _anytype_node(_compiled_node):
+    def __init__(self, json_structure, memo):
+        self.json_structure = json_structure
+    
+    def check(self, client_json, path='client_json'):
+        # client_json can be anything, including None -- we already know it's present
+        pass
+    
+    def project(self, client_json, path, coerce):
+        # Not copied:  there's no structure to prune it to
+        return None, client_json
+
+class _type_node(_compiled_node):
+    def __init__(self, json_structure, memo):
+        self.json_structure = json_structure
+    
+    def check(self, client_json, path='client_json'):
+        if not _is_json_type(self.json_structure, client_json):
+            return validation_error('type', path, self.json_structure, client_json)
+    
+    def project(self, client_json, path, coerce):
+        error = self.check(client_json, path)
+        if error is None and coerce:
+            return None, _coerce_json_type(self.json_structure, client_json)
+        return error, client_json
+
+class _regex_node(_compiled_node):
+    def __init__(self, json_structure, memo):
+        self.json_structure = json_structure
+    
+    def check(self, client_json, path='client_json'):
+        if not self.json_structure.match(client_json):
+            return validation_error('format', path, self.json_structure, client_json)
+    
+    def project(self, client_json, path, coerce):
+        return self.check(client_json, path), client_json
+
+
+def compile_schema(json_structure, codegen=False, limits=None):
+    """
+    Turn a json_structure into a tree of validator nodes, once, so that
+    validating client input doesn't have to re-interpret the structure.  The
+    returned object's validate(client_json) method accepts and rejects exactly
+    what do_validate(json_structure, client_json) does, with the same
+    JSONException messages.
+    @param json_structure:  An example json object, as for json_validate
+    @param codegen:         If True, instead generate and exec the source of a
+                            single flat validate() function; see
+                            generate_source()
+    @param limits:          Optional, a limits instance to check client input
+                            against before validating it
+    
+    >>> validator = compile_schema({'a': int, 'b': [str], 'c': optional(float)})
+    >>> validator.validate({'a': 1, 'b': ['x', 'y']})
+    >>> validator.validate({'a': 1, 'b': ['x', 2]})
+    Traceback (most recent call last):
+        ...
+    JSONException: Type error: client_json['b'][1] = 2, which is of type int.  A value of type str is required
+    >>> validator.validate({'b': []})
+    Traceback (most recent call last):
+        ...
+    JSONException: Key error:  missing key client_json['a']
+    >>> compile_schema([int, str])
+    Traceback (most recent call last):
+        ...
+    AssertionError: lists in json_validate structures must have exactly one element
+    """
+    if codegen:
+        schema = _generated_validator(json_structure)
+    else:
+        schema = _compile(json_structure, {})
+    
+    if limits is not None:
+        schema = _limits_node(schema, limits)
+    return schema
+
+class limits:
+    """
+    Limits on the size of client input as a whole, checked in one quick pass
+    before it's validated.  Containers are counted by their lengths and
+    lists and dicts of plain values aren't visited one by one, so with
+    max_nodes set, rejecting a huge input takes time in proportion to
+    max_nodes, not to the input's size.  Input over a limit fails with a
+    JSONLimitException.
+    @param max_depth:           Optional, how many keys or list indexes deep
+                                values can be nested
+    @param max_nodes:           Optional, how many values client input can
+                                hold in all
+    @param max_list_length:     Optional, how long any list can be
+    @param max_string_length:   Optional, how long any string can be
+    
+    >>> schema = compile_schema({'rows': [[int]]}, limits=limits(max_nodes=1000, max_depth=3))
+    >>> schema.validate({'rows': [[1, 2], [3]]})
+    >>> schema.validate({'rows': [range(10)] * 1000000})
+    Traceback (most recent call last):
+        ...
+    JSONLimitException: Limit error:  client_json['rows'] exceeds max_nodes = 1000
+    >>> schema.validate({'rows': [[[1]]]})
+    Traceback (most recent call last):
+        ...
+    JSONLimitException: Depth error:  client_json['rows'][0][0][0] is nested more than 3 levels deep
+    >>> import pickle
+    >>> pickle.loads(pickle.dumps(schema)).validate({'rows': [[1, None]]})
+    """
+    def __init__(self, max_depth=None, max_nodes=None, max_list_length=None, max_string_length=None):
+        self.max_depth = max_depth
+        self.max_nodes = max_nodes
+        self.max_list_length = max_list_length
+        self.max_string_length = max_string_length
+        
+        # Values with these types need no visit
+        self.plain_types = frozenset([int, float, bool, type(None)])
+        if max_string_length is None:
+            self.plain_types = self.plain_types | frozenset([str, unicode])
+    
+    def check(self, client_json, path='client_json'):
+        """
+        @return:    A 'depth' or 'limit' validation_error, or None
+        """
+        n_nodes = 1
+        if self.max_nodes is not None and n_nodes > self.max_nodes:
+            return validation_error('limit', path, ('max_nodes', self.max_nodes), n_nodes)
+        return self.count(client_json, path, 0, n_nodes)[0]
+    
+    def count(self, client_json, path, depth, n_nodes):
+        """
+        Check a value that's depth levels deep in client input, after
+        n_nodes values were counted, not including the value's own.
+        @return:    (validation_error or None, the values counted now)
+        """
+        max_depth, max_nodes = self.max_depth, self.max_nodes
+        max_list_length, max_string_length = self.max_list_length, self.max_string_length
+        plain_types = self.plain_types
+        
+        stack = [(client_json, path, depth)]
+        while stack:
+            value, path, depth = stack.pop()
+            if max_depth is not None and depth > max_depth:
+                return validation_error('depth', path, max_depth, value), n_nodes
+            
+            if isinstance(value, dict):
+                pass
+            elif isinstance(value, list):
+                if max_list_length is not None and len(value) > max_list_length:
+                    return validation_error('limit', path, ('max_list_length', max_list_length), len(value)), n_nodes
+            else:
+                if max_string_length is not None and isinstance(value, (str, unicode)) and len(value) > max_string_length:
+                    return validation_error('limit', path, ('max_string_length', max_string_length), len(value)), n_nodes
+                continue
+            
+            # Count before copying a dict's values, so a huge one is quick to
+            # reject
+            n_nodes += len(value)
+            if max_nodes is not None and n_nodes > max_nodes:
+                return validation_error('limit', path, ('max_nodes', max_nodes), n_nodes), n_nodes
+            if not value:
+                continue
+            values = list(value.values()) if isinstance(value, dict) else value
+            
+            if max_depth is not None and depth >= max_depth:
+                first_key = next(iter(value)) if isinstance(value, dict) else 0
+                return validation_error('depth', (path, first_key), max_depth, values[0]), n_nodes
+            
+            if not plain_types.issuperset(map(type, values)):
+                keys = value.keys() if isinstance(value, dict) else range(len(value))
+                stack.extend(
+                    (child, (path, key), depth + 1)
+                    for key, child in zip(keys, values)
+                    if type(child) not in plain_types
+                )
+        return None, n_nodes
+    
+    def __getstate__(self):
+        # Python 2 can't pickle type(None) in plain_types
+        return self.max_depth, self.max_nodes, self.max_list_length, self.max_string_length
+    
+    def __setstate__(self, state):
+        self.__init__(*state)
+    
+    def __repr__(self):
+        return 'limits(max_depth=%s, max_nodes=%s, max_list_length=%s, max_string_length=%s)' % (
+            self.max_depth, self.max_nodes, self.max_list_length, self.max_string_length
+        )
+
+class _limits_node(_compiled_node):
+    """
+    What compile_schema(json_structure, limits=...) returns:  checks limits,
+    then the compiled or generated schema
+    """
+    def __init__(self, schema, limits):
+        self.schema = schema
+        self.limits = limits
+        self.json_structure = schema.json_structure
+        self.value = _node_schema(schema)
+    
+    def check(self, client_json, path='client_json'):
+        error = self.limits.check(client_json, path)
+        if error is not None:
+            return error
+        return self.schema.check(client_json, path)
+    
+    def children(self, client_json, path):
+        error = self.limits.check(client_json, path)
+        if error is not None:
+            yield error
+        else:
+            yield self.value, client_json, path
+    
+    def check_changed(self, client_json, path, changes):
+        error = self.limits.check(client_json, path)
+        if error is not None:
+            return error
+        return self.value.check_changed(client_json, path, changes)
+    
+    def project(self, client_json, path, coerce):
+        error = self.limits.check(client_json, path)
+        if error is not None:
+            return error, None
+        return self.value.project(client_json, path, coerce)
+
+def _compile(json_structure, memo):
+    """
+    @param memo:    Dict from the ids of the parts of json_structure compiled
+                    so far to their nodes.  A structure that contains itself,
+                    like a tree node with a list of child nodes, compiles to a
+                    node that refers to itself.
+    """
+    if id(json_structure) in memo:
+        return memo[id(json_structure)]
+    
+    if isinstance(memo, _interning_memo):
+        return memo.intern(json_structure)
+    return _compile_node(json_structure, memo)
+
+def _compile_node(json_structure, memo):
+    # Same order as the if-statements in do_validate:  check for derived
+    # classes before base classes.
+    if isinstance(json_structure, (json_validator_wrapper, dict)):
+        return _object_node(json_structure, memo)
+    elif isinstance(json_structure, list):
+        return _list_node(json_structure, memo)
+    elif isinstance(json_structure, optional):
+        return _optional_node(json_structure, memo)
+    elif isinstance(json_structure, limited):
+        return _limited_node(json_structure, memo)
+    elif isinstance(json_structure, tagged_union):
+        return _tagged_union_node(json_structure, memo)
+    elif json_structure == anytype:
+        return _anytype_node(json_structure, memo)
+    elif type(json_structure) is type:
+        return _type_node(json_structure, memo)
+    elif hasattr(json_structure, 'match'):
+        # json_structure is a compiled regular expression
+        return _regex_node(json_structure, memo)
+    else:
+        raise TypeError('json_structure argument %s is of prohibited type' % repr(json_structure))
+
+def _structure_key(json_structure, keys, active, numbers):
+    """
+    A number that's equal for structurally identical json_structures, which
+    compile to equivalent nodes, or None for a json_structure that contains
+    itself or that compile_schema() rejects.
+    @param keys:    Dict from the ids of the structures keyed so far to their
+                    keys
+    @param active:  Set of the ids of the structures being keyed, to find
+                    structures that contain themselves
+    @param numbers: Dict from each distinct structure, described by its
+                    parts' numbers rather than by the parts themselves so it's
+                    quick to hash, to its number
+    """
+    if id(json_structure) in keys:
+        return keys[id(json_structure)]
+    if id(json_structure) in active:
+        return None
+    
+    # Same order as the if-statements in _compile_node().  Key order is part
+    # of the key, since it's the order of the keys in error messages.
+    parts = []
+    if isinstance(json_structure, json_validator_wrapper):
+        key = (json_structure.__class__,)
+        parts = [json_structure.json_structure] + json_structure.addends
+    elif isinstance(json_structure, dict):
+        key = (dict, tuple(json_structure.keys()))
+        parts = list(json_structure.values())
+    elif isinstance(json_structure, list):
+        key = (list,) if len(json_structure) == 1 else None
+        parts = json_structure
+    elif isinstance(json_structure, optional):
+        key = (optional,)
+        parts = [json_structure.value]
+    elif isinstance(json_structure, limited):
+        key = (limited, json_structure.max_length)
+        parts = [json_structure.value]
+    elif isinstance(json_structure, tagged_union):
+        key = (tagged_union, json_structure.tag, tuple(json_structure.tags))
+        parts = [json_structure.variants[tag] for tag in json_structure.tags]
+    elif json_structure == anytype:
+        key = (anytype,)
+    elif type(json_structure) is type:
+        key = (type, json_structure)
+    elif hasattr(json_structure, 'match'):
+        # A compiled regular expression or json_format, keyed by itself
+        key = (json_structure,)
+    else:
+        key = None
+    
+    if key is not None and parts:
+        active.add(id(json_structure))
+        part_keys = tuple(_structure_key(part, keys, active, numbers) for part in parts)
+        active.discard(id(json_structure))
+        if any(part_key is None for part_key in part_keys):
+            key = None
+        else:
+            key = key + (part_keys,)
+    
+    if key is not None:
+        key = numbers.setdefault(key, len(numbers))
+    keys[id(json_structure)] = key
+    return key
+
+class _interning_memo(dict):
+    """
+    A memo for _compile() that also compiles structurally identical parts of
+    json_structures, within one json_structure or across many, to the same
+    node
+    """
+    def __init__(self, nodes, numbers):
+        """
+        @param nodes:   Dict from structure keys to the nodes compiled for
+                        them, shared by the memos to intern nodes in
+        @param numbers: Dict from structures to structure keys, shared
+                        likewise; see _structure_key()
+        """
+        dict.__init__(self)
+        self.nodes = nodes
+        self.numbers = numbers
+        self.keys = {}
+        self.active = set()
+    
+    def key(self, json_structure):
+        return _structure_key(json_structure, self.keys, self.active, self.numbers)
+    
+    def intern(self, json_structure):
+        key = self.key(json_structure)
+        if key is None:
+            return _compile_node(json_structure, self)
+        
+        node = self.nodes.get(key)
+        if node is None:
+            node = self.nodes[key] = _compile_node(json_structure, self)
+        return node
+
+
+# The deepest indent _source_generator unrolls to; Python 2's compiler fails
+# on about 20 nested loops, and its parser on about 100 nested blocks
+_max_generated_indent = 12
+
+class _source_generator:
+    """
+    Emits the source of one flat Python function that checks client input
+    against a compiled validator tree:  isinstance checks are inlined, key
+    lookups are unrolled, and [T] lists become plain for-loops, so there are no
+    recursive calls or per-node dispatch at validation time.  Like the
+    compiled nodes' check() methods, the function returns a validation_error
+    or None.
+    """
+    def __init__(self):
+        self.lines = []
+        self.namespace = {'validation_error': validation_error, 'unicode': unicode}
+        self.n_names = 0
+        # Nodes being generated, to spot structures that contain themselves
+        self.active = set()
+    
+    def name(self, prefix):
+        self.n_names += 1
+        return '%s%d' % (prefix, self.n_names)
+    
+    def constant(self, value, prefix='_c'):
+        name = self.name(prefix)
+        self.namespace[name] = value
+        return name
+    
+    def literal(self, value):
+        # Keys are usually strings, which can appear in the source as-is
+        if type(value) in (str, unicode, int) and eval(repr(value)) == value:
+            return repr(value)
+        return self.constant(value, '_k')
+    
+    def type_name(self, t):
+        if t in (int, float, str, unicode, dict, list):
+            return t.__name__
+        return self.constant(t, '_t')
+    
+    def emit(self, indent, line):
+        self.lines.append('    ' * indent + line)
+    
+    def path_expr(self, path):
+        """
+        @param path:    Tuple of the expressions for the keys and list indexes
+                        from the root of the client input
+        """
+        expr = 'path'
+        for key in path:
+            expr = '(%s, %s)' % (expr, key)
+        return expr
+    
+    def fail(self, indent, kind, path, expected, value='None'):
+        self.emit(indent, 'return validation_error(%s, %s, %s, %s)' % (
+            repr(kind), self.path_expr(path), expected, value
+        ))
+    
+    def type_check(self, indent, t, var, path):
+        # Same rules as _is_json_type
+        if t is int:
+            failed = 'not (isinstance(%s, int) or %s is None or (isinstance(%s, float) and int(%s) == %s))' % (
+                var, var, var, var, var
+            )
+        elif t is float:
+            failed = 'not (isinstance(%s, (float, int)) or %s is None)' % (var, var)
+        elif t in (str, unicode):
+            failed = 'not (isinstance(%s, (str, unicode)) or %s is None)' % (var, var)
+        elif t in (dict, list):
+            failed = 'not isinstance(%s, %s)' % (var, t.__name__)
+        else:
+            failed = 'not (isinstance(%s, %s) or %s is None)' % (var, self.type_name(t), var)
+        
+        self.emit(indent, 'if %s:' % failed)
+        self.fail(indent + 1, 'type', path, self.type_name(t), var)
+    
+    def node(self, node, var, path, indent):
+        """
+        Emit the statements that check the value in variable var against
+        node.  Returns False if no statements were needed.
+        """
+        if id(node) in self.active or indent > _max_generated_indent:
+            # A structure that contains itself can't be unrolled, and Python
+            # can't compile deeply nested blocks:  call this function again,
+            # or the compiled node for an inner structure
+            error = self.name('error')
+            self.emit(indent, '%s = %s(%s, %s)' % (
+                error, 'check' if node is self.root else self.constant(node.check, '_check'),
+                var, self.path_expr(path)
+            ))
+            self.emit(indent, 'if %s is not None:' % error)
+            self.emit(indent + 1, 'return %s' % error)
+            return True
+        
+        self.active.add(id(node))
+        try:
+            return self.node_body(node, var, path, indent)
+        finally:
+            self.active.discard(id(node))
+    
+    def node_body(self, node, var, path, indent):
+        if isinstance(node, _object_node):
+            self.object_node(node, var, path, indent)
+        elif isinstance(node, _list_node):
+            self.type_check(indent, list, var, path)
+            if node.exact_types is not None:
+                self.emit(indent, 'if not %s.issuperset(map(type, %s)):' % (
+                    self.constant(node.exact_types, '_types'), var
+                ))
+                indent += 1
+            index, element = self.name('i'), self.name('v')
+            self.emit(indent, 'for %s, %s in enumerate(%s):' % (index, element, var))
+            if not self.node(node.element, element, path + (index,), indent + 1):
+                # Nothing to check, but the loop body can't be empty
+                self.lines.pop()
+        elif isinstance(node, _optional_node):
+            self.emit(indent, 'if %s:' % var)
+            if not self.node(node.value, var, path, indent + 1):
+                self.lines.pop()
+                return False
+        elif isinstance(node, _limited_node):
+            self.emit(indent, 'if isinstance(%s, (list, str, unicode)) and len(%s) > %d:' % (
+                var, var, node.max_length
+            ))
+            self.fail(indent + 1, 'limit', path, repr(('max_length', node.max_length)), 'len(%s)' % var)
+            self.node(node.value, var, path, indent)
+        elif isinstance(node, _tagged_union_node):
+            self.tagged_union_node(node, var, path, indent)
+        elif isinstance(node, _anytype_node):
+            return False
+        elif isinstance(node, _type_node):
+            self.type_check(indent, node.json_structure, var, path)
+        elif isinstance(node, _regex_node):
+            regex = self.constant(node.json_structure, '_re')
+            self.emit(indent, 'if not %s.match(%s):' % (regex, var))
+            self.fail(indent + 1, 'format', path, regex, var)
+        else:
+            raise TypeError('Cannot generate source for %s' % repr(node))
+        
+        return True
+    
+    def child(self, node, var, key, path, indent):
+        if isinstance(node, _anytype_node):
+            self.emit(indent, 'pass')
+            return
+        
+        child_var = self.name('v')
+        self.emit(indent, '%s = %s[%s]' % (child_var, var, key))
+        self.node(node, child_var, path + (key,), indent)
+    
+    def object_node(self, node, var, path, indent):
+        self.type_check(indent, dict, var, path)
+        
+        for key, child, is_optional in node.required:
+            key = self.literal(key)
+            self.emit(indent, 'if %s in %s:' % (key, var))
+            self.child(child, var, key, path, indent + 1)
+            if not is_optional:
+                self.emit(indent, 'else:')
+                self.fail(indent + 1, 'missing_key', path + (key,), self.constant(child.json_structure, '_s'))
+        
+        for one_of_keys, children, positions in node.one_of:
+            keys = self.constant(one_of_keys, '_keys')
+            found = ' + '.join('(%s in %s)' % (self.literal(key), var) for key in one_of_keys)
+            n_found = self.name('n')
+            self.emit(indent, '%s = %s' % (n_found, found or '0'))
+            self.emit(indent, 'if %s == 0:' % n_found)
+            self.fail(indent + 1, 'one_of_none', path, keys)
+            self.emit(indent, 'if %s > 1:' % n_found)
+            self.fail(indent + 1, 'one_of_several', path, keys, '[key for key in %s if key in %s]' % (keys, var))
+            self.branches(one_of_keys, children, var, path, indent)
+        
+        for atleast_one_keys, children, positions in node.atleast_one:
+            keys = self.constant(atleast_one_keys, '_keys')
+            self.branches(atleast_one_keys, children, var, path, indent)
+            self.emit(indent, 'else:' if atleast_one_keys else 'if True:')
+            self.fail(indent + 1, 'atleast_one_none', path, keys)
+    
+    def tagged_union_node(self, node, var, path, indent):
+        # One dict lookup picks the compiled variant to call, however many
+        # variants there are, where unrolling them would test each tag value
+        # in turn
+        self.type_check(indent, dict, var, path)
+        tag, tags = self.literal(node.tag), self.constant(node.json_structure.tags, '_tags')
+        self.emit(indent, 'if %s not in %s:' % (tag, var))
+        self.fail(indent + 1, 'missing_key', path + (tag,), tags)
+        
+        variants = self.constant(dict(
+            (value, variant.check) for value, variant in node.variants.items()
+        ), '_variants')
+        value, check, error = self.name('v'), self.name('check'), self.name('error')
+        self.emit(indent, '%s = %s[%s]' % (value, var, tag))
+        self.emit(indent, 'try:')
+        self.emit(indent + 1, '%s = %s.get(%s)' % (check, variants, value))
+        self.emit(indent, 'except TypeError:')
+        # Unhashable value, like a list
+        self.emit(indent + 1, '%s = None' % check)
+        self.emit(indent, 'if %s is None:' % check)
+        self.fail(indent + 1, 'tag', path + (tag,), tags, value)
+        self.emit(indent, '%s = %s(%s, %s)' % (error, check, var, self.path_expr(path)))
+        self.emit(indent, 'if %s is not None:' % error)
+        self.emit(indent + 1, 'return %s' % error)
+    
+    def branches(self, keys, children, var, path, indent):
+        # Check the first of keys present in var
+        for i, key in enumerate(keys):
+            child = children[key]
+            key = self.literal(key)
+            self.emit(indent, '%s %s in %s:' % ('elif' if i else 'if', key, var))
+            self.child(child, var, key, path, indent + 1)
+    
+    def generate(self, node):
+        self.root = node
+        self.emit(0, 'def check(client_json, path=%s):' % repr('client_json'))
+        if not self.node(node, 'client_json', (), 1):
+            self.emit(1, 'pass')
+        return '\n'.join(self.lines) + '\n'
+
+
+class _generated_validator(_compiled_node):
+    """
+    A validator whose check() function was generated by _source_generator;
+    see compile_schema(json_structure, codegen=True).
+    """
+    def __init__(self, json_structure, cache_dir=None):
+        """
+        @param cache_dir:   Optional, a directory to cache the compiled code
+                            in; see set_schema_cache()
+        """
+        self.json_structure = json_structure
+        generator = _source_generator()
+        self.nodes = compile_schema(json_structure)
+        self.source = generator.generate(self.nodes)
+        namespace = generator.namespace
+        exec(_compile_source(self.source, cache_dir), namespace)
+        self.check = namespace['check']
+    
+    def __getstate__(self):
+        # Generated functions can't be pickled, e.g. for validate_many()
+        return self.json_structure
+    
+    def __setstate__(self, json_structure):
+        self.__init__(json_structure)
+
+
+def _compile_source(source, cache_dir):
+    """
+    compile() generated source, or load the code compiled from the same
+    source by an earlier process from cache_dir.  Compiling is most of the
+    time it takes to generate a validator.
+    
+    >>> import shutil, tempfile
+    >>> cache_dir = tempfile.mkdtemp()
+    >>> validator = _generated_validator({'a': int}, cache_dir)
+    >>> [int_code] = os.listdir(cache_dir)
+    >>> validator = _generated_validator({'a': str}, cache_dir)
+    >>> [str_code] = [name for name in os.listdir(cache_dir) if name != int_code]
+    >>> # Swap in other code, to show it's loaded rather than compiled
+    >>> os.remove(os.path.join(cache_dir, int_code))
+    >>> os.rename(os.path.join(cache_dir, str_code), os.path.join(cache_dir, int_code))
+    >>> _generated_validator({'a': int}, cache_dir).check({'a': 1})
+    <validation_error Type error: client_json['a'] = 1, which is of type int.  A value of type str is required>
+    >>> shutil.rmtree(cache_dir)
+    """
+    if cache_dir is None:
+        return compile(source, '<json_validate>', 'exec')
+    
+    # Bytecode differs between Python versions
+    key = hashlib.sha1(sys.version.encode('utf-8'))
+    key.update(source if isinstance(source, bytes) else source.encode('utf-8'))
+    path = os.path.join(cache_dir, key.hexdigest() + '.code')
+    try:
+        with open(path, 'rb') as f:
+            return marshal.load(f)
+    except (IOError, OSError, EOFError, ValueError, TypeError):
+        # Not cached yet, or unreadable
+        pass
+    
+    code = compile(source, '<json_validate>', 'exec')
+    if os.path.exists(path):
+        # Another process cached it meanwhile, and on Windows os.rename()
+        # can't replace it
+        return code
+    
+    # Write then rename, so other processes never load a partial file
+    temp_path = '%s.%d.tmp' % (path, os.getpid())
+    try:
+        with open(temp_path, 'wb') as f:
+            marshal.dump(code, f)
+        os.rename(temp_path, path)
+    except (IOError, OSError) as e:
+        # The cache is only an optimization
+        logging.warn('Could not cache validator code in %s: %s' % (path, e))
+    return code
+
+def generate_source(json_structure):
+    """
+    Get the source of the function that compile_schema(json_structure,
+    codegen=True) generates, for inspection.
+    
+    >>> print(generate_source({'a': int, 'b': [str]}))
+    def check(client_json, path='client_json'):
+        if not isinstance(client_json, dict):
+            return validation_error('type', path, dict, client_json)
+        if 'a' in client_json:
+            v1 = client_json['a']
+            if not (isinstance(v1, int) or v1 is None or (isinstance(v1, float) and int(v1) == v1)):
+                return validation_error('type', (path, 'a'), int, v1)
+        else:
+            return validation_error('missing_key', (path, 'a'), _s2, None)
+        if 'b' in client_json:
+            v3 = client_json['b']
+            if not isinstance(v3, list):
+                return validation_error('type', (path, 'b'), list, v3)
+            if not _types4.issuperset(map(type, v3)):
+                for i5, v6 in enumerate(v3):
+                    if not (isinstance(v6, (str, unicode)) or v6 is None):
+                        return validation_error('type', ((path, 'b'), i5), str, v6)
+        else:
+            return validation_error('missing_key', (path, 'b'), _s7, None)
+    <BLANKLINE>
+
+    Deeply nested structures are checked by calling their compiled nodes:
+
+    >>> schema, client_json = int, 'x'
+    >>> for i in range(60):
+    ...     schema, client_json = [{'a': schema}], [{'a': client_json}]
+    >>> compile_schema(schema, codegen=True).validate(client_json) # doctest: +ELLIPSIS
+    Traceback (most recent call last):
+        ...
+    JSONException: Type error: client_json[0]['a']...[0]['a'] = 'x', which is of type str.  A value of type int is required
+    """
+    return _generated_validator(json_structure).source
+
+
+def _compiled(schema):
+    """
+    @param schema:  A json_structure, or what compile_schema() returned for it
+    """
+    if isinstance(schema, _compiled_node):
+        return schema
+    return compile_schema(schema)
+
+def is_valid(schema, client_json):
+    """
+    Like do_validate, but returns True or False instead of raising a
+    JSONException.  Compile the schema once with compile_schema() and pass
+    that in, rather than the raw json_structure, to avoid recompiling it on
+    every call.
+    @param schema:      A json_structure, or what compile_schema() returned
+    @param client_json: An object passed in from a client
+    
+    >>> schema = compile_schema({'a': int, 'b': one_of({'c': str, 'd': str})})
+    >>> is_valid(schema, {'a': 1, 'b': {'c': 'foo'}})
+    True
+    >>> is_valid(schema, {'a': 'one', 'b': {'c': 'foo'}})
+    False
+    """
+    return _compiled(schema).check(client_json) is None
+
+def first_error(schema, client_json):
+    """
+    Like do_validate, but returns the first validation_error found, or None
+    if client_json is valid.  Nothing is formatted unless you call str() on
+    the error.
+    @param schema:      A json_structure, or what compile_schema() returned
+    @param client_json: An object passed in from a client
+    
+    >>> schema = compile_schema({'a': [int], 'b': one_of({'c': str, 'd': str})})
+    >>> first_error(schema, {'a': [1, 2], 'b': {'c': 'foo'}})
+    >>> error = first_error(schema, {'a': [1, 'two'], 'b': {'c': 'foo'}})
+    >>> error.path, error.kind, error.expected
+    (('a', 1), 'type', <type 'int'>)
+    >>> str(error)
+    "Type error: client_json['a'][1] = 'two', which is of type str.  A value of type int is required"
+    >>> error = first_error(schema, {'a': [], 'b': {'c': 'foo', 'd': 'bar'}})
+    >>> error.path, error.kind, error.value
+    (('b',), 'one_of_several', ['c', 'd'])
+    
+    Paths and messages name the schema's keys, even for decoded JSON:
+    
+    >>> schema = compile_schema({'h': one_of({'a': str, 'b': str, 'd': str})})
+    >>> print(first_error(schema, json.loads('{"h": {"a": "foo", "b": "bar"}}')))
+    client_json['h'] requires one of these keys: ['a', 'b', 'd'], but found several: ['a', 'b']
+    >>> print(first_error(schema, json.loads('{"h": {"a": 1}}')))
+    Type error: client_json['h']['a'] = 1, which is of type int.  A value of type str is required
+    """
+    return _compiled(schema).check(client_json)
+
+
+def check_iterative(schema, client_json, max_depth=None):
+    """
+    Like first_error, but walks client_json with an explicit stack instead of
+    recursing, so deeply nested input can't hit Python's recursion limit.
+    The result is the same as first_error's.
+    @param schema:      A json_structure, or what compile_schema() returned
+    @param client_json: An object passed in from a client
+    @param max_depth:   Optional, fail with a 'depth' validation_error as soon
+                        as a value is nested more than max_depth keys or list
+                        indexes deep
+    
+    >>> comment = {'text': str}
+    >>> comment['replies'] = optional([comment])
+    >>> thread = {'text': 'Hi'}
+    >>> for i in range(5000):
+    ...     thread = {'text': 'Re: Hi', 'replies': [thread]}
+    >>> check_iterative(comment, thread)
+    >>> error = check_iterative(comment, thread, max_depth=100)
+    >>> error.kind, len(error.path)
+    ('depth', 101)
+    >>> check_iterative(comment, {'text': 'Hi', 'replies': [{'text': 1}]}, max_depth=100)
+    <validation_error Type error: client_json['replies'][0]['text'] = 1, which is of type int.  A value of type str is required>
+    """
+    return _check_iterative(_node_schema(schema), client_json, max_depth)
+
+def _node_schema(schema):
+    # The iterative engine needs compiled nodes, not generated code
+    schema = _compiled(schema)
+    if isinstance(schema, _deferred_node):
+        schema = schema.compile()
+    if isinstance(schema, _generated_validator):
+        return schema.nodes
+    return schema
+
+def _check_iterative(schema, client_json, max_depth=None, timings=None):
+    """
+    @param timings: Optional dict from schema paths like
+                    "client_json['items'][*]['ts']" to [calls, time spent,
+                    failures], to add this check's timings to
+    """
+    # Stack of (generator of child nodes, path, depth, schema path, whether
+    # the node is a list, start time) for the nodes being checked.  Visiting
+    # children depth-first, as the generators yield them, finds the same
+    # first error as check().
+    stack = []
+    node, value, path, depth, schema_path = schema, client_json, 'client_json', 0, 'client_json'
+    error = None
+    while error is None:
+        if max_depth is not None and depth > max_depth:
+            error = validation_error('depth', path, max_depth, value)
+            break
+        
+        if node.children is None:
+            if timings is None:
+                error = node.check(value, path)
+            else:
+                start = _clock()
+                error = node.check(value, path)
+                _add_timing(timings, schema_path, _clock() - start, error is not None)
+            if error is not None:
+                break
+        else:
+            stack.append((
+                node.children(value, path), path, depth, schema_path,
+                isinstance(node, _list_node), timings is not None and _clock()
+            ))
+        
+        # Find the next node to check
+        while stack:
+            children, parent_path, parent_depth, parent_schema_path, in_list, start = stack[-1]
+            item = next(children, None)
+            if item is None:
+                stack.pop()
+                if timings is not None:
+                    _add_timing(timings, parent_schema_path, _clock() - start, False)
+            elif type(item) is not tuple:
+                # A validation_error
+                error = item
+                break
+            else:
+                node, value, path = item
+                if path is parent_path:
+                    # Optional values and tagged union variants aren't nested
+                    depth, schema_path = parent_depth, parent_schema_path
+                else:
+                    depth = parent_depth + 1
+                    if timings is not None:
+                        schema_path = parent_schema_path + (
+                            '[*]' if in_list else '[%s]' % repr(path[1])
+                        )
+                break
+        else:
+            return None
+    
+    if timings is not None:
+        # The nodes still on the stack failed, because of error
+        for children, parent_path, parent_depth, parent_schema_path, in_list, start in stack:
+            _add_timing(timings, parent_schema_path, _clock() - start, True)
+    return error
+
+def validate_iterative(schema, client_json, max_depth=None):
+    """
+    Like do_validate, but uses check_iterative():  throw a JSONException if
+    client_json doesn't validate, or is nested more than max_depth deep.
+    """
+    error = check_iterative(schema, client_json, max_depth)
+    if error is not None:
+        raise error.exception()
+
+def _json_pointer_keys(pointer):
+    """
+    The keys in a JSON Pointer like '/a/0/b~1c', as strings
+    """
+    if not pointer:
+        return []
+    if not pointer.startswith('/'):
+        # Client input, so not an assert, which python -O would strip
+        raise ValueError("JSON Pointer %s must start with '/'" % repr(pointer))
+    return [key.replace('~1', '/').replace('~0', '~') for key in pointer.split('/')[1:]]
+
+def json_patch_paths(operations):
+    """
+    The paths a JSON Patch (RFC 6902) changes, as lists of keys.  Adding or
+    removing a list element moves the ones after it, and the same keys could
+    be a dict's, so those operations change the whole list or dict.
+    @param operations:  A list of operations like
+                        {'op': 'replace', 'path': '/a/0', 'value': 1}
+    
+    >>> json_patch_paths([{'op': 'move', 'from': '/a/0', 'path': '/b'}, {'op': 'test', 'path': '/c', 'value': 1}])
+    [['a'], ['b']]
+    >>> json_patch_paths([{'op': 'remove', 'path': 'a/b'}])
+    Traceback (most recent call last):
+        ...
+    ValueError: JSON Pointer 'a/b' must start with '/'
+    """
+    def changed(pointer, shifts):
+        keys = _json_pointer_keys(pointer)
+        if shifts and keys and (keys[-1] == '-' or keys[-1].isdigit()):
+            keys.pop()
+        return keys
+    
+    paths = []
+    for operation in operations:
+        op = operation['op']
+        if op == 'move':
+            paths.append(changed(operation['from'], True))
+        if op != 'test':
+            paths.append(changed(operation['path'], op != 'replace'))
+    return paths
+
+def _changes_tree(changed):
+    """
+    Turn a list of paths, or a JSON Patch, into a tree of nested dicts from
+    keys to their changes, with True for keys whose whole value changed.
+    """
+    if changed and isinstance(changed[0], dict):
+        changed = json_patch_paths(changed)
+    
+    tree = {}
+    for keys in changed:
+        if not keys:
+            return True
+        node = tree
+        for key in keys[:-1]:
+            child = node.get(key)
+            if child is True:
+                break
+            if child is None:
+                child = node[key] = {}
+            node = child
+        else:
+            node[keys[-1]] = True
+    return tree
+
+def _list_index(client_json, key):
+    """
+    The index in client_json a changed path's key refers to, or None if it
+    refers to none.  Keys from JSON Patches are strings.
+    """
+    try:
+        index = int(key)
+    except (TypeError, ValueError):
+        return None
+    if 0 <= index < len(client_json):
+        return index
+
+def _check_changed(node, client_json, path, changes):
+    if changes is None:
+        # Unchanged, and valid before
+        return None
+    elif changes is True:
+        return node.check(client_json, path)
+    else:
+        return node.check_changed(client_json, path, changes)
+
+def check_changed(schema, client_json, changed):
+    """
+    Revalidate client_json after changing part of it, assuming it was valid
+    before.  Only the changed values, and the key constraints of the dicts
+    around them, are checked; the result is the same as
+    first_error(schema, client_json).
+    @param schema:      A json_structure, or what compile_schema() returned
+    @param client_json: The client input, after the changes
+    @param changed:     The paths in client_json that changed, like
+                        [['a', 0, 'b']], or a JSON Patch that made the
+                        changes, like
+                        [{'op': 'add', 'path': '/a/0/b', 'value': 1}]
+    @return:            A validation_error, or None if client_json is valid
+    
+    >>> schema = compile_schema({'id': int, 'items': [one_of({'a': int, 'b': str})]})
+    >>> doc = {'id': 1, 'items': [{'a': 1}, {'b': 'two'}]}
+    >>> doc['items'][1]['a'] = 2
+    >>> check_changed(schema, doc, [{'op': 'add', 'path': '/items/1/a', 'value': 2}])
+    <validation_error client_json['items'][1] requires one of these keys: ['a', 'b'], but found several: ['a', 'b']>
+    >>> check_changed(schema, doc, [['id']]) is None
+    True
+    """
+    return _check_changed(_node_schema(schema), client_json, 'client_json', _changes_tree(changed))
+
+def validate_changed(schema, client_json, changed):
+    """
+    Like check_changed(), but throw a JSONException if client_json doesn't
+    validate.
+    """
+    error = check_changed(schema, client_json, changed)
+    if error is not None:
+        raise error.exception()
+
+
+# time.perf_counter is more precise, where it exists
+_clock = getattr(time, 'perf_counter', time.time)
+
+def _add_timing(timings, key, elapsed, failed):
+    timing = timings.get(key)
+    if timing is None:
+        timing = timings[key] = [0, 0.0, 0]
+    timing[0] += 1
+    timing[1] += elapsed
+    timing[2] += failed
+
+class _validation_stats:
+    """
+    Timings collected by the decorators while enable_validation_stats() is
+    on.
+    """
+    def __init__(self, paths):
+        self.paths = paths
+        self.lock = threading.Lock()
+        # {function name: [calls, time spent, failures]}
+        self.functions = {}
+        # {function name: {schema path: [calls, time spent, failures]}}
+        self.schema_paths = {}
+    
+    def validate(self, name, schema, client_json):
+        """
+        Like schema.validate(client_json), but record how it went under name
+        """
+        if self.paths:
+            timings = {}
+            schema = _node_schema(schema)
+            start = _clock()
+            error = _check_iterative(schema, client_json, timings=timings)
+        else:
+            start = _clock()
+            error = schema.check(client_json)
+        elapsed = _clock() - start
+        
+        with self.lock:
+            _add_timing(self.functions, name, elapsed, error is not None)
+            if self.paths:
+                function_timings = self.schema_paths.setdefault(name, {})
+                for schema_path, (calls, time_spent, failures) in timings.items():
+                    timing = function_timings.setdefault(schema_path, [0, 0.0, 0])
+                    timing[0] += calls
+                    timing[1] += time_spent
+                    timing[2] += failures
+        
+        if error is not None:
+            raise error.exception()
+    
+    def project(self, name, schema, client_json, coerce):
+        """
+        Like validate_project(schema, client_json, coerce), but record how it
+        went under name.  Schema paths aren't timed.
+        """
+        start = _clock()
+        error, projection = _node_schema(schema).project(client_json, 'client_json', coerce)
+        elapsed = _clock() - start
+        
+        with self.lock:
+            _add_timing(self.functions, name, elapsed, error is not None)
+        
+        if error is not None:
+            raise error.exception()
+        return projection
+    
+    def snapshot(self):
+        def entry(timing):
+            return {'calls': timing[0], 'time': timing[1], 'failures': timing[2]}
+        
+        with self.lock:
+            return {
+                'functions': dict(
+                    (name, entry(timing)) for name, timing in self.functions.items()
+                ),
+                'paths': dict(
+                    (name, dict(
+                        (schema_path, entry(timing)) for schema_path, timing in timings.items()
+                    ))
+                    for name, timings in self.schema_paths.items()
+                ),
+            }
+
+# The current _validation_stats, or None when they're off
+_stats = None
+
+def enable_validation_stats(paths=False):
+    """
+    Start recording, for each function decorated with json_validate or
+    json_validate_warn, how many times it validated input, the total time
+    that took, and how many times the input was invalid.  Read them with
+    get_validation_stats().  While stats are off, which is the default, the
+    decorators pay only for checking whether they're on.
+    @param paths:   Optional, also record the calls, time and failures for
+                    each part of the structure, like
+                    "client_json['items'][*]['ts']".  This validates with
+                    check_iterative(), which is slower.
+    
+    >>> @json_validate({'items': [{'ts': json_timestamp}]})
+    ... def handler(self, json):
+    ...     pass
+    >>> enable_validation_stats(paths=True)
+    >>> handler(None, {'items': [{'ts': '2011-08-31T12:00:00'}, {'ts': '2011-08-31T12:00:01'}]})
+    >>> handler(None, {'items': [{'ts': 'yesterday'}]}) # doctest: +ELLIPSIS
+    Traceback (most recent call last):
+        ...
+    JSONException: Format error:  client_json['items'][0]['ts'] = 'yesterday', does not match required pattern ...
+    >>> stats = get_validation_stats(reset=True)
+    >>> [function_stats] = stats['functions'].values()
+    >>> function_stats['calls'], function_stats['failures']
+    (2, 1)
+    >>> [path_stats] = stats['paths'].values()
+    >>> for schema_path in sorted(path_stats):
+    ...     print('%s %s %s' % (schema_path, path_stats[schema_path]['calls'], path_stats[schema_path]['failures']))
+    client_json 2 1
+    client_json['items'] 2 1
+    client_json['items'][*] 3 1
+    client_json['items'][*]['ts'] 3 1
+    >>> disable_validation_stats()
+    """
+    global _stats
+    _stats = _validation_stats(paths)
+
+def disable_validation_stats():
+    """
+    Stop recording stats, and discard the ones recorded so far.
+    """
+    global _stats
+    _stats = None
+
+def get_validation_stats(reset=False):
+    """
+    Get a snapshot of the stats recorded since enable_validation_stats(), like:
+    
+    {
+        'functions': {function name: {'calls': n, 'time': seconds, 'failures': n}},
+        'paths': {function name: {schema path: {'calls': ..., 'time': ..., 'failures': ...}}},
+    }
+    
+    'paths' is empty unless enable_validation_stats(paths=True).  Returns None
+    if stats are off.
+    @param reset:   Optional, start recording from scratch after the snapshot
+    """
+    global _stats
+    stats = _stats
+    if stats is None:
+        return None
+    
+    snapshot = stats.snapshot()
+    if reset:
+        _stats = _validation_stats(stats.paths)
+    return snapshot
+
+def _function_name(f):
+    """
+    A name for f that's unique in its module, even on Python 2, which has no
+    qualified names for methods
+    
+    >>> class handlers:
+    ...     class A:
+    ...         def post(self, json): pass
+    ...     class B:
+    ...         def post(self, json): pass
+    >>> _function_name(handlers.A.post) == _function_name(handlers.B.post)
+    False
+    """
+    name = getattr(f, '__qualname__', None)
+    if name is None:
+        # Tell apart same-named methods of different classes by where they
+        # start
+        code = getattr(f, '__code__', None)
+        name = f.__name__ if code is None else '%s:%d' % (f.__name__, code.co_firstlineno)
+    return '%s.%s' % (f.__module__, name)
+
+
+def _check_chunk(schema, docs):
+    # Module-level, so that process pools can pickle it
+    check = schema.check
+    return [check(client_json) for client_json in docs]
+
+# {digest: schema}, what _check_pickled_chunk() unpickled in this process,
+# emptied when it's full
+_unpickled_schemas = {}
+_max_unpickled_schemas = 64
+
+def _pickled_schema(schema):
+    """
+    Pickle schema once, to send with each chunk of work to a process pool
+    @return:    (digest, pickled schema)
+    """
+    state = pickle.dumps(schema, pickle.HIGHEST_PROTOCOL)
+    return hashlib.sha1(state).hexdigest(), state
+
+def _check_pickled_chunk(pickled, docs):
+    """
+    Like _check_chunk, but unpickles what _pickled_schema() returned only
+    the first time this process sees it:  unpickling a generated validator
+    generates and compiles it again, which takes longer than checking a
+    chunk.
+    """
+    digest, state = pickled
+    schema = _unpickled_schemas.get(digest)
+    if schema is None:
+        schema = pickle.loads(state)
+        if len(_unpickled_schemas) >= _max_unpickled_schemas:
+            _unpickled_schemas.clear()
+        _unpickled_schemas[digest] = schema
+    return _check_chunk(schema, docs)
+
+def _is_process_pool(executor):
+    """
+    Whether executor is a concurrent.futures.ProcessPoolExecutor, whose work
+    must be pickled
+    """
+    # If concurrent.futures.process isn't imported, executor can't be one
+    process = sys.modules.get('concurrent.futures.process')
+    return process is not None and isinstance(executor, process.ProcessPoolExecutor)
+
+def validate_many(schema, docs, executor=None, chunk_size=100, processes=None):
+    """
+    Check many independent documents against the same schema, compiling it
+    only once.  Pass a concurrent.futures executor to spread the work:  a
+    ProcessPoolExecutor uses all cores despite the GIL (the compiled schema
+    is pickled once, and each worker process unpickles it once), while a
+    ThreadPoolExecutor only helps on free-threaded builds.
+    @param schema:      A json_structure, or what compile_schema() returned
+    @param docs:        An iterable of objects passed in from clients
+    @param executor:    Optional concurrent.futures.Executor; by default the
+                        documents are checked in this thread
+    @param chunk_size:  Optional, how many documents to send to the executor
+                        at a time; bigger chunks amortize pickling
+    @param processes:   Optional, whether executor runs work in other
+                        processes, so the schema must be pickled; by default,
+                        whether it's a ProcessPoolExecutor
+    @return:            A list with a validation_error or None per document,
+                        in the same order as docs
+    
+    >>> validate_many({'a': int}, [{'a': 1}, {'a': 'one'}, {}])
+    [None, <validation_error Type error: client_json['a'] = 'one', which is of type str.  A value of type int is required>, <validation_error Key error:  missing key client_json['a']>]
+    >>> import multiprocessing
+    >>> class pool_executor:
+    ...     # multiprocessing.Pool with the submit() of concurrent.futures'
+    ...     # ProcessPoolExecutor, which Python 2 doesn't have
+    ...     def __init__(self, processes):
+    ...         self.pool = multiprocessing.Pool(processes)
+    ...     def submit(self, fn, *args):
+    ...         future = self.pool.apply_async(fn, args)
+    ...         future.result = future.get
+    ...         return future
+    >>> executor = pool_executor(2)
+    >>> schema = compile_schema({'a': [int]})
+    >>> validate_many(schema, [{'a': [1, None]}, {'a': [1, 'two']}], executor, chunk_size=1, processes=True)
+    [None, <validation_error Type error: client_json['a'][1] = 'two', which is of type str.  A value of type int is required>]
+    >>> executor.pool.terminate()
+    >>> # Threads share the schema, so it needn't be picklable
+    >>> import multiprocessing.pool
+    >>> executor.pool = multiprocessing.pool.ThreadPool(2)
+    >>> hex_id = json_format(r'^[0-9a-f]+$', lambda value: not value.strip('0123456789abcdef'))
+    >>> validate_many({'id': hex_id}, [{'id': 'ff'}, {'id': 'xyz'}], executor, chunk_size=1)
+    [None, <validation_error Format error:  client_json['id'] = 'xyz', does not match required pattern '^[0-9a-f]+$'>]
+    >>> executor.pool.terminate()
+    """
+    schema = _compiled(schema)
+    if executor is None:
+        return _check_chunk(schema, docs)
+    
+    if processes is None:
+        processes = _is_process_pool(executor)
+    if processes:
+        check, schema = _check_pickled_chunk, _pickled_schema(schema)
+    else:
+        check = _check_chunk
+    
+    futures = []
+    chunk = []
+    for client_json in docs:
+        chunk.append(client_json)
+        if len(chunk) == chunk_size:
+            futures.append(executor.submit(check, schema, chunk))
+            chunk = []
+    if chunk:
+        futures.append(executor.submit(check, schema, chunk))
+    
+    results = []
+    for future in futures:
+        results.extend(future.result())
+    return results
+
+
+# How the json module ends its error messages
+_json_error_position = re.compile(r'(.*): line \d+ column \d+ \(char (\d+)\)$')
+
+# The characters that can continue a number, and the longest part of a
+# token that can be cut off at the end of a buffer and fail to decode:
+# '-Infinity' or '\\uXXXX' in a string
+_json_number_tail = re.compile(r'[-+.eE0-9]*\Z')
+_json_max_partial_token = len('-Infinity')
+
+class _json_stream_reader:
+    """
+    Decodes the elements of a JSON array one at a time from a file-like
+    object, keeping only a buffer of not-yet-decoded text in memory.
+    """
+    def __init__(self, fileobj, chunk_size):
+        self.fileobj = fileobj
+        self.chunk_size = chunk_size
+        self.buffer = ''
+        self.pos = 0
+        # Characters dropped from the start of the buffer
+        self.dropped = 0
+        self.eof = False
+        self.decoder = json.JSONDecoder()
+        self.text_decoder = None
+    
+    def read(self, size):
+        """
+        Append up to size more characters to the buffer, dropping what's
+        already decoded.  Returns False at end of file.
+        """
+        chunk = self.fileobj.read(size)
+        if not chunk:
+            self.eof = True
+            return False
+        
+        if bytes is not str and isinstance(chunk, bytes):
+            # Bytes from a binary file in Python 3
+            if self.text_decoder is None:
+                self.text_decoder = codecs.getincrementaldecoder('utf-8')()
+            chunk = self.text_decoder.decode(chunk)
+        
+        self.buffer = self.buffer[self.pos:] + chunk
+        self.dropped += self.pos
+        self.pos = 0
+        return True
+    
+    def offset(self):
+        """
+        The position in the whole text, for error messages
+        """
+        return self.dropped + self.pos
+    
+    def peek(self):
+        """
+        Skip whitespace, and get the next character, or '' at end of file.
+        """
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in ' \t\n\r':
+                self.pos += 1
+            if self.pos < len(self.buffer) or not self.read(self.chunk_size):
+                return self.buffer[self.pos:self.pos + 1]
+    
+    def value(self):
+        """
+        Decode the next JSON value, reading more of the file as needed.
+        """
+        size = self.chunk_size
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+            except ValueError as e:
+                # Only read more if the value might continue in the next
+                # chunk, so a syntax error early in a huge file doesn't
+                # read the rest of it into the buffer
+                if self.eof or not self.cut_off(e):
+                    raise self.error(e)
+            else:
+                # A number at the end of the buffer, like 1 or 1.5e, might
+                # continue in the next chunk
+                if self.eof or not _json_number_tail.match(self.buffer, end):
+                    self.pos = end
+                    return value
+            
+            # Read bigger chunks for big values, so they aren't decoded over
+            # and over
+            self.read(size)
+            size *= 2
+    
+    def error_position(self, e):
+        """
+        The decoder's ValueError e's message, and the position in the buffer
+        it's about
+        """
+        match = _json_error_position.match(str(e))
+        if match is None:
+            # Python 2's decoder says 'No JSON object could be decoded', with
+            # no position, when the value at pos can't even start, or a value
+            # in it can't.  Its pure Python scanner says where.
+            pos = _json_whitespace.match(self.buffer, self.pos).end()
+            if self.buffer[pos:pos + 1] not in ('[', '{'):
+                return str(e), pos
+            decoder = json.JSONDecoder()
+            decoder.scan_once = json.scanner.py_make_scanner(decoder)
+            try:
+                decoder.raw_decode(self.buffer, pos)
+            except ValueError as py_e:
+                match = _json_error_position.match(str(py_e))
+            if match is None:
+                # Both use the C scanstring, which says 'end is out of
+                # bounds' for a string whose quote ends the buffer
+                return str(e), len(self.buffer)
+        return match.group(1), int(match.group(2))
+    
+    def cut_off(self, e):
+        """
+        Whether the decoder's ValueError e might be because the value it was
+        decoding continues past the end of the buffer
+        """
+        message, pos = self.error_position(e)
+        # The decoder reports an unterminated string at its start
+        return (message.startswith('Unterminated string') or
+                pos >= len(self.buffer) - _json_max_partial_token)
+    
+    def error(self, e):
+        """
+        The decoder's ValueError e, with the position in the whole text
+        rather than in the buffer
+        """
+        message, pos = self.error_position(e)
+        return ValueError('%s: char %d' % (message, self.dropped + pos))
+    
+    def rest(self):
+        """
+        Decode everything left in the file as one JSON value.
+        """
+        while self.read(self.chunk_size):
+            pass
+        return self.value()
+
+def validate_stream(schema, fileobj, raise_errors=True, chunk_size=65536):
+    """
+    Validate a JSON array as it's read from fileobj, one element at a time, so
+    memory use is bounded by the size of an element rather than of the whole
+    document.  Returns a generator.
+    
+    By default the generator yields each valid element and raises a
+    JSONException for the first invalid one.  With raise_errors=False it
+    yields (element, validation_error or None) for every element.  Either
+    way, paths read like client_json[12345]['field'].  If the document isn't
+    an array at all, the generator raises a JSONException.
+    
+    @param schema:          A [T] json_structure, or what compile_schema()
+                            returned for one
+    @param fileobj:         A file-like object with a read(size) method
+    @param raise_errors:    Optional, whether to raise or yield errors
+    @param chunk_size:      Optional, how many bytes to read at a time
+    
+    >>> import io
+    >>> stream = io.BytesIO(b'[{"a": 1}, {"a": 2.0}, {"a": "three"}, {"b": 4}]')
+    >>> for element, error in validate_stream([{'a': int}], stream, raise_errors=False):
+    ...     print('%s %s' % (element, error))
+    {u'a': 1} None
+    {u'a': 2.0} None
+    {u'a': u'three'} Type error: client_json[2]['a'] = u'three', which is of type unicode.  A value of type int is required
+    {u'b': 4} Key error:  missing key client_json[3]['a']
+    >>> list(validate_stream([int], io.BytesIO(b' [1, 2, 3, 4.5] '), chunk_size=2))
+    Traceback (most recent call last):
+        ...
+    JSONException: Type error: client_json[3] = 4.5, which is of type float.  A value of type int is required
+    >>> list(validate_stream(compile_schema([int], limits=limits(max_nodes=3)), io.BytesIO(b'[1, 2, 3]')))
+    Traceback (most recent call last):
+        ...
+    JSONLimitException: Limit error:  client_json exceeds max_nodes = 3
+    >>> list(validate_stream([int], io.BytesIO(b'[1, 2] xx')))
+    Traceback (most recent call last):
+        ...
+    ValueError: Extra data: char 7
+    >>> list(validate_stream([int], io.BytesIO(b'[1, 2]]'), chunk_size=2))
+    Traceback (most recent call last):
+        ...
+    ValueError: Extra data: char 6
+    >>> list(validate_stream([float], io.BytesIO(b'[1.5, 2e3]'), chunk_size=3))
+    [1.5, 2000.0]
+    >>> stream = io.BytesIO(b'[1, 2, x, ' + b'1, ' * 100000 + b'1]')
+    >>> list(validate_stream([int], stream, chunk_size=16))
+    Traceback (most recent call last):
+        ...
+    ValueError: No JSON object could be decoded: char 7
+    >>> stream.tell() <= 32
+    True
+    """
+    schema = _compiled(schema)
+    list_schema, limits = _node_schema(schema), None
+    if isinstance(list_schema, _limits_node):
+        list_schema, limits = list_schema.value, list_schema.limits
+    if not isinstance(list_schema, _list_node):
+        raise TypeError('validate_stream requires a [T] json_structure, not %s' % repr(schema.json_structure))
+    
+    return _validate_stream(schema, list_schema.element, limits, _json_stream_reader(fileobj, chunk_size), raise_errors)
+
+def _validate_stream(schema, element, limits, reader, raise_errors):
+    if reader.peek() != '[':
+        # Not an array:  let the schema describe the problem
+        schema.validate(reader.rest())
+    
+    reader.pos += 1
+    if limits is not None:
+        # The array itself counts as a value
+        error = limits.check([])
+        if error is not None:
+            raise error.exception()
+    i = 0
+    n_nodes = 1
+    while reader.peek() != ']':
+        if i:
+            if reader.peek() != ',':
+                raise ValueError('Expecting , delimiter: char %d' % reader.offset())
+            reader.pos += 1
+            reader.peek()
+        
+        client_value = reader.value()
+        error = None
+        if limits is not None:
+            # The array's limits, counted as its elements arrive
+            n_nodes += 1
+            if limits.max_list_length is not None and i + 1 > limits.max_list_length:
+                error = validation_error('limit', 'client_json', ('max_list_length', limits.max_list_length), i + 1)
+            elif limits.max_nodes is not None and n_nodes > limits.max_nodes:
+                error = validation_error('limit', 'client_json', ('max_nodes', limits.max_nodes), n_nodes)
+            else:
+                error, n_nodes = limits.count(client_value, ('client_json', i), 1, n_nodes)
+            if error is not None:
+                # Every later element would be over the limits too
+                if raise_errors:
+                    raise error.exception()
+                yield client_value, error
+                return
+        
+        error = element.check(client_value, ('client_json', i))
+        if not raise_errors:
+            yield client_value, error
+        elif error is not None:
+            raise error.exception()
+        else:
+            yield client_value
+        
+        i += 1
+    
+    reader.pos += 1
+    if reader.peek() != '':
+        raise ValueError('Extra data: char %d' % reader.offset())
+
+
+# The types of the values json.loads() returns, which validation_cache can
+# key by repr().  type(2 ** 64) is long on Python 2.
+_json_native_types = frozenset([dict, list, str, unicode, int, type(2 ** 64), float, bool, type(None)])
+
+def _is_json_native(client_json):
+    """
+    True if client_json is made only of _json_native_types, not subclasses
+    """
+    stack = [client_json]
+    while stack:
+        value = stack.pop()
+        if type(value) is dict:
+            if not _json_native_types.issuperset(map(type, value)):
+                return False
+            values = list(value.values())
+        elif type(value) is list:
+            values = value
+        else:
+            if type(value) not in _json_native_types:
+                return False
+            continue
+        
+        types = set(map(type, values))
+        if not _json_native_types.issuperset(types):
+            return False
+        if dict in types or list in types:
+            stack.extend(child for child in values if type(child) in (dict, list))
+    return True
+
+class validation_cache:
+    """
+    A bounded, least-recently-used cache of validation results, for clients
+    that send the same input over and over.  Results are keyed by the schema
+    object and a hash of the raw request bytes, if you have them, or else of
+    the decoded input's repr(), which tells apart values that validate
+    differently, like 1 and '1' or str and unicode.  Decoded input that
+    isn't made only of the types json.loads() returns, like a tuple, isn't
+    cached.  Invalid inputs are cached too, with their errors.  Share one
+    between threads if you like.
+    
+    Checking and serializing the decoded input costs about as much as
+    validating a simple structure, so hashing the raw bytes pays off more.
+    @param max_size:    Optional, the most results to keep
+    @param ttl:         Optional, seconds to keep each result
+    
+    >>> cache = validation_cache(max_size=100)
+    >>> schema = compile_schema({'id': int})
+    >>> cache.validate(schema, {'id': 1})
+    >>> cache.validate(schema, {'id': 1})
+    >>> for i in range(2):
+    ...     try:
+    ...         cache.validate(schema, {'id': 'x'})
+    ...     except JSONException as e:
+    ...         print(e)
+    Type error: client_json['id'] = 'x', which is of type str.  A value of type int is required
+    Type error: client_json['id'] = 'x', which is of type str.  A value of type int is required
+    >>> sorted(cache.stats().items())
+    [('hits', 2), ('misses', 2), ('size', 2)]
+    >>> cache.check([int], [1, 2]), cache.check([int], (1, 2))
+    (None, <validation_error Type error: client_json = (1, 2), which is of type tuple.  A value of type list is required>)
+    >>> cache.check({'id': int}, {'id': u'x'})
+    <validation_error Type error: client_json['id'] = u'x', which is of type unicode.  A value of type int is required>
+    """
+    def __init__(self, max_size=1024, ttl=None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        # {(schema, digest): (expiry time or None, validation_error or None)}
+        self.results = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+    
+    def key(self, schema, client_json, raw=None):
+        """
+        @return:    The cache key, or None if client_json isn't made only of
+                    JSON types
+        """
+        if raw is not None:
+            kind = 'raw'
+        elif _is_json_native(client_json):
+            kind, raw = 'repr', repr(client_json)
+        else:
+            return None
+        if not isinstance(raw, bytes):
+            raw = raw.encode('utf-8')
+        return schema, kind, hashlib.sha1(raw).digest()
+    
+    def check(self, schema, client_json, raw=None):
+        """
+        Like schema.check(client_json), from the cache if possible
+        @param schema:      A json_structure, or what compile_schema()
+                            returned.  Structurally identical json_structures
+                            share cached results.
+        @param client_json: The client input
+        @param raw:         Optional, the bytes client_json was decoded from
+        """
+        if not isinstance(schema, _compiled_node):
+            schema = _registry.compile_now(schema)
+        key = self.key(schema, client_json, raw)
+        if key is None:
+            return schema.check(client_json)
+        
+        now = _clock()
+        with self.lock:
+            entry = self.results.pop(key, None)
+            if entry is not None and (entry[0] is None or entry[0] > now):
+                # Most recently used goes last
+                self.results[key] = entry
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+        
+        error = schema.check(client_json)
+        expiry = None if self.ttl is None else now + self.ttl
+        with self.lock:
+            self.results[key] = (expiry, error)
+            while len(self.results) > self.max_size:
+                self.results.popitem(last=False)
+        return error
+    
+    def validate(self, schema, client_json, raw=None):
+        """
+        Like schema.validate(client_json), from the cache if possible
+        """
+        error = self.check(schema, client_json, raw)
+        if error is not None:
+            raise error.exception()
+    
+    def stats(self):
+        with self.lock:
+            return {'hits': self.hits, 'misses': self.misses, 'size': len(self.results)}
+    
+    def clear(self):
+        with self.lock:
+            self.results.clear()
+            self.hits = self.misses = 0
+
+_json_whitespace = re.compile(r'[ \t\n\r]*')
+
+class raw_json:
+    """
+    A value that validate_bytes(..., project=True) didn't need to decode,
+    because the structure allows anytype there.
+    @ivar text: The value's JSON text
+    """
+    def __init__(self, text):
+        self.text = text
+    
+    def decode(self):
+        return json.loads(self.text)
+    
+    def __repr__(self):
+        return 'raw_json(%s)' % repr(self.text)
+
+class _projecting_decoder:
+    """
+    Decodes JSON text guided by compiled nodes:  the values of keys the
+    structure doesn't mention are dropped, and anytype values are kept as
+    raw_json.  Both are checked for syntax errors like the rest.
+    """
+    def __init__(self, text):
+        self.text = text
+        self.decoder = json.JSONDecoder()
+        # Replaces each object with its number of keys as soon as it's
+        # decoded, so skipped values never build more than one path's worth
+        # of dicts.  len is a builtin, so it costs less than building them.
+        self.skipper = json.JSONDecoder(object_pairs_hook=len)
+    
+    def skip_whitespace(self, pos):
+        return _json_whitespace.match(self.text, pos).end()
+    
+    def expect(self, pos, chars):
+        c = self.text[pos:pos + 1]
+        if not c or c not in chars:
+            raise ValueError('Expecting %s: char %d' % (' or '.join(chars), pos))
+        return c
+    
+    def value(self, node, pos):
+        """
+        @return:    The value at pos, and the position after it
+        """
+        pos = self.skip_whitespace(pos)
+        c = self.text[pos:pos + 1]
+        is_optional = False
+        while isinstance(node, (_optional_node, _limited_node, _limits_node)):
+            if isinstance(node, _optional_node):
+                is_optional = True
+            else:
+                # Lengths and limits are checked on the whole decoded value.
+                # If it's within them, it's decoded again like the rest, so
+                # it's pruned the same way.
+                whole, end = self.decoder.raw_decode(self.text, pos)
+                if isinstance(node, _limited_node):
+                    error = node.check_length(whole, 'client_json')
+                else:
+                    error = node.limits.check(whole)
+                if error is not None:
+                    # Validating it reports the error
+                    return whole, end
+            node = node.value
+        
+        if isinstance(node, _object_node) and c == '{':
+            result, end = self.object(node, pos)
+            if is_optional and not result and node.check(result) is not None:
+                # optional only validates a true value, so an object with no
+                # keys from the structure needs all of its keys, for
+                # validating it to report the missing ones
+                return self.decoder.raw_decode(self.text, pos)
+            return result, end
+        elif isinstance(node, _tagged_union_node) and c == '{':
+            tag_value, variant = self.variant(node, pos)
+            if variant is None:
+                # No tag, or one the structure doesn't know:  validating it
+                # reports the error
+                return self.decoder.raw_decode(self.text, pos)
+            result, end = self.value(variant, pos)
+            if isinstance(result, dict):
+                result[node.tag] = tag_value
+            return result, end
+        elif isinstance(node, _list_node) and c == '[':
+            return self.array(node, pos)
+        elif isinstance(node, _anytype_node):
+            end = self.skip(pos)
+            return raw_json(self.text[pos:end]), end
+        else:
+            # Something the validator will look at
+            return self.decoder.raw_decode(self.text, pos)
+    
+    def object(self, node, pos):
+        result = {}
+        key_nodes = node.key_nodes
+        pos = self.skip_whitespace(pos + 1)
+        if self.text[pos:pos + 1] == '}':
+            return result, pos + 1
+        
+        while True:
+            self.expect(pos, '"')
+            key, pos = json.decoder.scanstring(self.text, pos + 1)
+            pos = self.skip_whitespace(pos)
+            self.expect(pos, ':')
+            pos = self.skip_whitespace(pos + 1)
+            
+            child = key_nodes.get(key)
+            if child is None:
+                pos = self.skip(pos)
+            else:
+                result[key], pos = self.value(child, pos)
+            
+            pos = self.skip_whitespace(pos)
+            if self.expect(pos, ',}') == '}':
+                return result, pos + 1
+            pos = self.skip_whitespace(pos + 1)
+    
+    def variant(self, node, pos):
+        """
+        Find the tag value of the object at pos, skipping the values of the
+        keys before the tag.
+        @param node:    A _tagged_union_node
+        @return:        The tag value and the compiled variant it selects, or
+                        None for the variant if there isn't one
+        """
+        pos = self.skip_whitespace(pos + 1)
+        if self.text[pos:pos + 1] == '}':
+            return None, None
+        
+        while True:
+            self.expect(pos, '"')
+            key, pos = json.decoder.scanstring(self.text, pos + 1)
+            pos = self.skip_whitespace(pos)
+            self.expect(pos, ':')
+            pos = self.skip_whitespace(pos + 1)
+            
+            if key == node.tag:
+                tag_value = self.decoder.raw_decode(self.text, pos)[0]
+                try:
+                    return tag_value, node.variants.get(tag_value)
+                except TypeError:
+                    # Unhashable value, like a list
+                    return tag_value, None
+            
+            pos = self.skip_whitespace(self.skip(pos))
+            if self.expect(pos, ',}') == '}':
+                return None, None
+            pos = self.skip_whitespace(pos + 1)
+    
+    def array(self, node, pos):
+        result = []
+        element = node.element
+        pos = self.skip_whitespace(pos + 1)
+        if self.text[pos:pos + 1] == ']':
+            return result, pos + 1
+        
+        while True:
+            value, pos = self.value(element, pos)
+            result.append(value)
+            pos = self.skip_whitespace(pos)
+            if self.expect(pos, ',]') == ']':
+                return result, pos + 1
+            pos = self.skip_whitespace(pos + 1)
+    
+    def skip(self, pos):
+        """
+        @return:    The position after the value at pos
+        """
+        # The C decoder checks the syntax exactly like json.loads(), faster
+        # than scanning the text in Python would
+        value, end = self.skipper.raw_decode(self.text, pos)
+        return end
+
+def validate_bytes(schema, raw, project=False, cache=None):
+    """
+    Decode a client's raw JSON request body and validate it in one call.
+    Throws a JSONException if it doesn't validate, or a ValueError if it isn't
+    JSON.
+    
+    With project=True, the structure guides the decoding:  the values of keys
+    it doesn't mention are dropped, and anytype values are returned as
+    raw_json.  Both are still checked for syntax errors, but the objects in
+    them are thrown away as soon as they're decoded, so they take less time
+    and memory than decoding them whole; arrays in them are still built while
+    they're checked.  The result is only the part of the document that
+    validation needs.  Values in a limited() or in a schema compiled with
+    limits are decoded whole to check them, then again to prune them.
+    Otherwise the whole document is decoded and returned.
+    @param schema:      A json_structure, or what compile_schema() returned
+    @param raw:         JSON text, as bytes or a string
+    @param project:     Optional, return only the schema-relevant projection
+    @param cache:       Optional, a validation_cache to look raw up in, when
+                        not projecting
+    
+    >>> schema = compile_schema({'id': int, 'blob': anytype, 'tags': [{'name': str}]})
+    >>> raw = b'{"id": 1, "extra": {"big": [1, 2, "]"]}, "blob": [{"x": 1}], "tags": [{"name": "a", "n": 2}]}'
+    >>> projection = validate_bytes(schema, raw, project=True)
+    >>> sorted(projection.items())
+    [(u'blob', raw_json('[{"x": 1}]')), (u'id', 1), (u'tags', [{u'name': u'a'}])]
+    >>> validate_bytes(schema, b'{"id": "one", "blob": null, "tags": []}', project=True)
+    Traceback (most recent call last):
+        ...
+    JSONException: Type error: client_json['id'] = u'one', which is of type unicode.  A value of type int is required
+    >>> try:
+    ...     validate_bytes(schema, b'{"id": 1, "blob": [nonsense], "tags": []}', project=True)
+    ... except ValueError:
+    ...     print('Not JSON')
+    Not JSON
+    >>> validate_bytes({'blob': limited(anytype, 3)}, b'{"blob": [1, 2, 3, 4]}', project=True)
+    Traceback (most recent call last):
+        ...
+    JSONLimitException: Limit error:  client_json['blob'] exceeds max_length = 3
+    >>> schema = compile_schema(anytype, limits=limits(max_string_length=5))
+    >>> validate_bytes(schema, b'["too long"]', project=True)
+    Traceback (most recent call last):
+        ...
+    JSONLimitException: Limit error:  client_json[0] exceeds max_string_length = 5
+    >>> schema = compile_schema({'id': int, 'tags': limited([{'name': str}], 2)}, limits=limits(max_depth=4))
+    >>> projection = validate_bytes(schema, b'{"id": 1, "extra": 2, "tags": [{"name": "a", "n": 2}]}', project=True)
+    >>> sorted(projection.items())
+    [(u'id', 1), (u'tags', [{u'name': u'a'}])]
+    >>> schema = compile_schema(tagged_union('type', {'click': {'x': int}, 'upload': {'data': anytype}}))
+    >>> projection = validate_bytes(schema, b'{"data": [1, 2], "size": 2, "type": "upload"}', project=True)
+    >>> sorted(projection.items())
+    [(u'data', raw_json('[1, 2]')), ('type', u'upload')]
+    """
+    if cache is not None and not project:
+        client_json = json.loads(raw)
+        cache.validate(schema, client_json, raw)
+        return client_json
+    
+    if bytes is not str and isinstance(raw, bytes):
+        raw = raw.decode('utf-8')
+    
+    if project:
+        schema = _node_schema(schema)
+        decoder = _projecting_decoder(raw)
+        client_json, end = decoder.value(schema, 0)
+        end = decoder.skip_whitespace(end)
+        if end != len(raw):
+            raise ValueError('Extra data: char %d' % end)
+    else:
+        schema = _compiled(schema)
+        client_json = json.loads(raw)
+    
+    schema.validate(client_json)
+    return client_json
+
+
+def validate_project(schema, client_json, coerce=False):
+    """
+    Validate client_json and return a copy of it with only the keys the
+    structure declares, built in the same pass.  Throws a JSONException if
+    client_json doesn't validate.  Values the structure allows to be anytype
+    are kept as they are, not copied; so are the keys of an atleast_one
+    group after the first one found, which aren't validated.
+    @param schema:      A json_structure, or what compile_schema() returned
+    @param client_json: The client input
+    @param coerce:      Optional, convert values the way the type checks
+                        allow:  3.0 to the int 3, ints to floats, and UTF-8
+                        strs to unicode
+    
+    >>> schema = compile_schema(required({'id': int, 'scores': [float]}) + atleast_one({'name': str, 'nick': str}))
+    >>> projection = validate_project(schema, {'id': 3.0, 'scores': [1, 2.5], 'name': 'Al', 'extra': [1]}, coerce=True)
+    >>> sorted(projection.items())
+    [('id', 3), ('name', u'Al'), ('scores', [1.0, 2.5])]
+    >>> validate_project(schema, {'id': 1, 'scores': ['x']})
+    Traceback (most recent call last):
+        ...
+    JSONException: Type error: client_json['scores'][0] = 'x', which is of type str.  A value of type float is required
+    >>> validate_project({'a': str, 'b': [str]}, {'a': '\\xff', 'b': ['\\xc3\\xa9']}, coerce=True)
+    {'a': '\\xff', 'b': [u'\\xe9']}
+    """
+    error, projection = _node_schema(schema).project(client_json, 'client_json', coerce)
+    if error is not None:
+        raise error.exception()
+    return projection
+
+
+class _schema_registry:
+    """
+    Every function decorated with json_validate and the like, and the schemas
+    compiled for them.  Structurally identical json_structures, and
+    structurally identical parts of them, like an address or a page of
+    results that many functions take, are compiled once and shared.
+    
+    >>> registry = _schema_registry()
+    >>> address = {'street': str, 'city': str}
+    >>> users = registry.compile({'name': str, 'home': address})
+    >>> shops = registry.compile({'name': str, 'address': {'street': str, 'city': str}})
+    >>> users.key_nodes['home'] is shops.key_nodes['address']
+    True
+    >>> registry.compile({'name': str, 'home': address}) is users
+    True
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        # List of (function name, json_structure, schema)
+        self.functions = []
+        # {(structure key, codegen, limits): schema}
+        self.schemas = {}
+        # {structure key: compiled node}, shared by all the schemas
+        self.nodes = {}
+        # {structure: structure key}; see _structure_key()
+        self.numbers = {}
+        self.defer = False
+        self.cache_dir = None
+    
+    def compile(self, json_structure, codegen=False, limits=None):
+        """
+        Like compile_schema(), but reuses what's been compiled before, and
+        returns a _deferred_node if compiling is deferred
+        """
+        if self.defer:
+            return _deferred_node(self, json_structure, codegen, limits)
+        return self.compile_now(json_structure, codegen, limits)
+    
+    def compile_now(self, json_structure, codegen=False, limits=None):
+        with self.lock:
+            memo = _interning_memo(self.nodes, self.numbers)
+            key = memo.key(json_structure)
+            if key is not None:
+                limits_key = None if limits is None else (
+                    limits.max_depth, limits.max_nodes, limits.max_list_length, limits.max_string_length
+                )
+                key = (key, codegen, limits_key)
+                if key in self.schemas:
+                    return self.schemas[key]
+            
+            if codegen:
+                schema = _generated_validator(json_structure, self.cache_dir)
+            else:
+                schema = _compile(json_structure, memo)
+            if limits is not None:
+                schema = _limits_node(schema, limits)
+            
+            if key is not None:
+                self.schemas[key] = schema
+            return schema
+    
+    def register(self, name, json_structure, schema):
+        with self.lock:
+            self.functions.append((name, json_structure, schema))
+    
+    def warm_up(self):
+        with self.lock:
+            deferred = [
+                schema for name, json_structure, schema in self.functions
+                if isinstance(schema, _deferred_node) and schema.schema is None
+            ]
+        
+        for schema in deferred:
+            schema.compile()
+        return len(deferred)
+
+_registry = _schema_registry()
+
+class _deferred_node(_compiled_node):
+    """
+    What a decorator's json_structure compiles to while compiling is
+    deferred:  the json_structure is compiled the first time it's used, or in
+    warm_up()
+    """
+    def __init__(self, registry, json_structure, codegen, limits):
+        self.registry = registry
+        self.json_structure = json_structure
+        self.codegen = codegen
+        self.limits = limits
+        self.schema = None
+    
+    def compile(self):
+        if self.schema is None:
+            schema = self.registry.compile_now(self.json_structure, self.codegen, self.limits)
+            # Later calls go straight to the compiled schema
+            self.check = schema.check
+            self.schema = schema
+        return self.schema
+    
+    def check(self, client_json, path='client_json'):
+        return self.compile().check(client_json, path)
+    
+    # _node_schema() usually gets the compiled nodes for these
+    def children(self, client_json, path):
+        return _node_schema(self.compile()).children(client_json, path)
+    
+    def check_changed(self, client_json, path, changes):
+        return _node_schema(self.compile()).check_changed(client_json, path, changes)
+    
+    def project(self, client_json, path, coerce):
+        return _node_schema(self.compile()).project(client_json, path, coerce)
+    
+    def __getstate__(self):
+        # The registry's lock can't be pickled, e.g. for validate_many()
+        return self.json_structure, self.codegen, self.limits
+    
+    def __setstate__(self, state):
+        self.__init__(_registry, *state)
+
+def defer_compiling(defer=True):
+    """
+    Have json_validate and the other decorators only register their
+    json_structures from now on, and compile them in warm_up() or the first
+    time a wrapped function is called, so importing many decorated functions
+    is quick.  A json_structure that compile_schema() rejects is then rejected
+    there, rather than when the decorator is applied.
+    @param defer:   Optional, False to compile when decorating again
+    """
+    _registry.defer = defer
+
+def set_schema_cache(cache_dir):
+    """
+    Save the compiled code of validators that decorators generate with
+    codegen=True in cache_dir, and load it from there rather than compiling
+    the same generated source again, e.g. in each of many short-lived worker
+    processes.  The cache is keyed by the source and the Python version, so
+    it never needs clearing, but only use a directory that no one else can
+    write to:  what's in it is run as code.
+    @param cache_dir:   An existing directory, or None to stop caching
+    """
+    _registry.cache_dir = cache_dir
+
+def warm_up():
+    """
+    Compile every json_structure that decorators have registered and that
+    hasn't been compiled yet; see defer_compiling().  Call it at process
+    start, before forking workers, so that no request pays for compiling.
+    @return:    The number of schemas compiled
+    
+    >>> defer_compiling()
+    >>> @json_validate({'offset': int, 'limit': int})
+    ... def list_users(self, json):
+    ...     return json
+    >>> warm_up()
+    1
+    >>> list_users(None, {'offset': 0, 'limit': 'ten'})
+    Traceback (most recent call last):
+        ...
+    JSONException: Type error: client_json['limit'] = 'ten', which is of type str.  A value of type int is required
+    >>> defer_compiling(False)
+    """
+    return _registry.warm_up()
+
+def get_registered_schemas():
+    """
+    @return:    List of (function name, json_structure) for every function
+                decorated with json_validate and the like, in the order they
+                were decorated
+    """
+    with _registry.lock:
+        return [(name, json_structure) for name, json_structure, schema in _registry.functions]
+
+
+def json_validate(json_structure, codegen=False, project=False, coerce=False, cache=None, limits=None):
+    """
+    Generalize a way to validate JSON fields.  The json_structure parameter is
+    a description of the kind of client input the wrapped function requires.
+    The json_structure allowed values are <type 'int'>, <type 'float'>,
+    <type 'str'>, a list, a dict, or a compiled regular expression.  If
+    json_structure is a list or dict, each of its members must also be one of
+    the allowed values, and so on recursively.
+    
+    The wrapper will throw a JSONException if the client-input JSON
+    does not have a structure that matches json_structure.  Ergo:
+
+    If json_structure is <type 'str'>, client input must be a string or unicode.
+
+    If json_structure is <type 'int'>, client input must be an int, or a float
+    with no fractional part.
+    
+    If json_structure is <type 'float'>, client input must be an int or a float.
+    
+    If json_structure is a compiled regular expression, client input must be a
+    matching string.  (Remember to end your regex with '$'.)
+    
+    If json_structure is a list with one member, client input must be a list of
+    zero or more members, each client-input member matching the json_structure
+    member.
+    
+    If json_structure is a dict, client input must be a dict (a JSON 'object')
+    with the all the keys json_structure has, and its values must match the
+    corresponding json_structure values.  The validator ignores extra keys in
+    client input.
+    
+    @param json_structure:  An example json object, the kind of input the wrapped
+                            function requires.
+    @param codegen:         Optional, validate with generated source instead of
+                            compiled nodes; see compile_schema()
+    @param project:         Optional, pass the wrapped function only the keys
+                            json_structure declares; see validate_project()
+    @param coerce:          Optional, with project, also convert the values;
+                            see validate_project()
+    @param cache:           Optional, a validation_cache to remember results
+                            in.  Cached results aren't timed by
+                            enable_validation_stats().
+    @param limits:          Optional, a limits instance to check client input
+                            against first
+
+    >>> json_structure = required({'must_be_here':str}) + {
+    ...     'a': int,
+    ...     'b': float,
+    ...     'c': str,
+    ...     'd': [int],
+    ...     'e': anytype,
+    ...     'f': {'nested_structure': float},
+    ...     'g': re.compile('^fo*$'),
+    ...     'h': one_of({'a': int, 'b': list}),
+    ...     'i': atleast_one({'a': int, 'b': list}),
+    ... } + atleast_one({'more_keys': str})
+    >>> class C:
+    ...     @json_validate(json_structure)
+    ...     def fn(self, input):
+    ...         print(input)
+    ... 
+    >>> c = C()
+    >>> c.fn({
+    ...     'must_be_here': 'is here',
+    ...     'a': 1.0,
+    ...     'b': 2.5,
+    ...     'c': 'Hi!',
+    ...     'd': [1, 2, 3],
+    ...     'e': [],
+    ...     'f': {'nested_structure': 5},
+    ...     'extra_key': 'this is ignored by json_validate',
+    ...     'g': 'fooooooooo',
+    ...     'h': {'b':['anything','is','OK','here']},
+    ...     'i': {'a':1},
     ...     'more_keys': ''
     ... })
     {'must_be_here': 'is here', 'a': 1.0, 'c': 'Hi!', 'b': 2.5, 'e': [], 'd': [1, 2, 3], 'g': 'fooooooooo', 'f': {'nested_structure': 5}, 'i': {'a': 1}, 'h': {'b': ['anything', 'is', 'OK', 'here']}, 'more_keys': '', 'extra_key': 'this is ignored by json_validate'}
@@ -481,12 +3488,30 @@ def json_validate(json_structure):
         'h': {'b':['anything','is','OK','here']},
     json_validate.JSONException: client_json['h'] requires one of these keys: ['a', 'b'], but found several: ['a', 'b']
     """
+    # Interpret json_structure once, not on every call
+    schema = _registry.compile(json_structure, codegen, limits)
+    validate = schema.validate
+    
     # the decorator
     def validator_wrapper(f):
+        name = _function_name(f)
+        _registry.register(name, json_structure, schema)
+        
         @functools.wraps(f)
         def validator(self, json):
             try:
-                do_validate(json_structure, json)
+                stats = _stats
+                if project:
+                    if stats is None:
+                        json = validate_project(schema, json, coerce)
+                    else:
+                        json = stats.project(name, schema, json, coerce)
+                elif cache is not None:
+                    cache.validate(schema, json)
+                elif stats is None:
+                    validate(json)
+                else:
+                    stats.validate(name, schema, json)
             except JSONException as e:
                 # If JSON doesn't validate, add some extra debugging info and re-raise
                 e.client_json = json
@@ -503,39 +3528,66 @@ def json_validate(json_structure):
         return validator
     return validator_wrapper
         
-def json_validate_warn(json_structure):
+def json_validate_warn(json_structure, codegen=False, cache=None, sample_rate=1.0, warning_interval=None,
+                       limits=None):
     """
-    Like json_validate, but only logs warning on validation failure.
+    Like json_validate, but only logs warning on validation failure.  Each
+    failure is counted under its schema path; see get_warning_counts().
+    @param sample_rate:         Optional, the fraction of calls to validate,
+                                from 0.0 to 1.0
+    @param warning_interval:    Optional, log the warnings for each schema
+                                path and kind of error at most once in this
+                                many seconds, with a count of the ones not
+                                logged since.  Functions with an interval
+                                also log at most _max_warning_lines lines a
+                                minute between them.
+    @param limits:              Optional, a limits instance to check client
+                                input against first
+    
+    >>> class print_handler(logging.Handler):
+    ...     def emit(self, record):
+    ...         print(record.getMessage())
+    >>> handler = print_handler()
+    >>> logging.getLogger().addHandler(handler)
+    >>> @json_validate_warn({'ids': [int]}, warning_interval=60)
+    ... def list_items(json, context):
+    ...     return {}
+    >>> for i in range(3):
+    ...     rv = list_items({'ids': [1, 'x%d' % i]}, {})
+    ? ?: Type error: client_json['ids'][1] = 'x0', which is of type str.  A value of type int is required
+    >>> logging.getLogger().removeHandler(handler)
     """
+    # Interpret json_structure once, not on every call
+    schema = _registry.compile(json_structure, codegen, limits)
+    validate = schema.validate
+    
     # the decorator
     def validate_warner(f):
+        name = _function_name(f)
+        _registry.register(name, json_structure, schema)
+        policy = _warning_policy(name, sample_rate, warning_interval)
+        
         # the function
         @functools.wraps(f)
         def validate_warner(json,context,*args,**kwargs):
             warning = None
-            try:
-                do_validate(json_structure, json)
-            except JSONException as e:
-                # Didn't validate
-                warning = str(e)
-                url, method = '?', '?'
-                if 'rq' in context:
-                    method = context['rq'].method
-                    url = context['rq'].get_full_path()
-                
-                # Don't re-raise, just warn
-                logging.warn('%s %s: %s' % (
-                    method, url, warning
-                ))
+            if policy.sampled():
+                try:
+                    stats = _stats
+                    if cache is not None:
+                        cache.validate(schema, json)
+                    elif stats is None:
+                        validate(json)
+                    else:
+                        stats.validate(name, schema, json)
+                except JSONException as e:
+                    # Didn't validate
+                    warning = policy.warn(context, e)
             
             rv = f(json,context,*args,**kwargs)
             
             if warning:
-                try:
-                    # Tell client about validation error
-                    rv['warning'] = warning
-                except Exception as e:
-                    logging.error(e)
+                _add_warning(rv, warning)
             
             return rv
         
@@ -546,6 +3598,454 @@ def json_validate_warn(json_structure):
         return functools.update_wrapper(validate_warner, f)
     return validate_warner
 
+def _log_warning(context, warning):
+    url, method = '?', '?'
+    if 'rq' in context:
+        method = context['rq'].method
+        url = context['rq'].get_full_path()
+    
+    # Don't re-raise, just warn
+    logging.warn('%s %s: %s' % (
+        method, url, warning
+    ))
+
+# The most distinct warnings a _warning_policy remembers
+_max_logged_warnings = 1000
+
+# The most lines json_validate_warn functions with a warning_interval log in
+# a minute, all together, and [start of the minute, lines logged in it]
+_max_warning_lines = 100
+_warning_lines = [0.0, 0]
+
+def _take_warning_line(now):
+    """
+    @return:    True if there's room for another line in this minute's log
+                lines; call with _warning_counts_lock held
+    """
+    if now - _warning_lines[0] >= 60:
+        _warning_lines[:] = [now, 0]
+    if _warning_lines[1] >= _max_warning_lines:
+        return False
+    _warning_lines[1] += 1
+    return True
+
+# {function name: {schema path: failures}} for json_validate_warn functions
+_warning_counts = {}
+_warning_counts_lock = threading.Lock()
+
+class _warning_policy:
+    """
+    How a json_validate_warn function samples calls to validate, and logs
+    and counts the failures
+    """
+    def __init__(self, name, sample_rate, warning_interval):
+        self.name = name
+        self.sample_rate = sample_rate
+        self.warning_interval = warning_interval
+        # {(schema path, kind of error): [time last logged, times not
+        # logged since]}
+        self.logged = collections.OrderedDict()
+    
+    def sampled(self):
+        return self.sample_rate >= 1 or random.random() < self.sample_rate
+    
+    def warn(self, context, e):
+        """
+        Count and maybe log the JSONException e
+        @return:    The warning for the client
+        """
+        warning = str(e)
+        error = getattr(e, 'validation_error', None)
+        schema_path = 'client_json' if error is None else error.schema_path()
+        
+        log, not_logged = True, 0
+        with _warning_counts_lock:
+            counts = _warning_counts.setdefault(self.name, {})
+            counts[schema_path] = counts.get(schema_path, 0) + 1
+            
+            if self.warning_interval is not None:
+                # Not the message, which has the bad value and list indexes
+                # in it, so that varied bad input still counts as the same
+                key = (schema_path, None if error is None else error.kind)
+                now = _clock()
+                entry = self.logged.pop(key, None) or [None, 0]
+                if (entry[0] is None or now - entry[0] >= self.warning_interval) and _take_warning_line(now):
+                    not_logged = entry[1]
+                    entry = [now, 0]
+                else:
+                    entry[1] += 1
+                    log = False
+                
+                # Most recent goes last
+                self.logged[key] = entry
+                while len(self.logged) > _max_logged_warnings:
+                    self.logged.popitem(last=False)
+        
+        if log:
+            if not_logged:
+                _log_warning(context, '%s (%d more like it not logged)' % (warning, not_logged))
+            else:
+                _log_warning(context, warning)
+        return warning
+
+def get_warning_counts(reset=False):
+    """
+    Get the failures of each function decorated with json_validate_warn
+    since the last reset, by schema path:
+    {function name: {schema path: failures}}
+    @param reset:   Optional, start counting from zero after this
+    
+    >>> @json_validate_warn({'items': [{'id': int}]}, warning_interval=60)
+    ... def handler(json, context):
+    ...     return {}
+    >>> handler({'items': [{'id': 1}, {'id': 'two'}]}, {})
+    {'warning': "Type error: client_json['items'][1]['id'] = 'two', which is of type str.  A value of type int is required"}
+    >>> handler({'items': [{'id': 'one'}]}, {})['warning']
+    "Type error: client_json['items'][0]['id'] = 'one', which is of type str.  A value of type int is required"
+    >>> [counts] = get_warning_counts(reset=True).values()
+    >>> counts
+    {"client_json['items'][*]['id']": 2}
+    """
+    with _warning_counts_lock:
+        snapshot = dict((name, dict(counts)) for name, counts in _warning_counts.items())
+        if reset:
+            _warning_counts.clear()
+    return snapshot
+
+def _add_warning(rv, warning):
+    try:
+        # Tell client about validation error
+        rv['warning'] = warning
+    except Exception as e:
+        logging.error(e)
+    return rv
+
+
+def _json_size_over(client_json, threshold):
+    """
+    True if client_json holds more than threshold values in all, counting
+    no further than that
+    """
+    count = 0
+    stack = [client_json]
+    while stack:
+        value = stack.pop()
+        count += 1
+        if isinstance(value, dict):
+            value = list(value.values())
+        if isinstance(value, list):
+            if count + len(value) > threshold:
+                return True
+            stack.extend(value)
+        elif count > threshold:
+            return True
+    return False
+
+# {id(schema): (schema, _pickled_schema(schema))} for the async decorators'
+# schemas, which live as long as the functions they decorate
+_schema_pickles = {}
+
+def _pickled_once(schema):
+    entry = _schema_pickles.get(id(schema))
+    if entry is None or entry[0] is not schema:
+        entry = _schema_pickles[id(schema)] = (schema, _pickled_schema(schema))
+    return entry[1]
+
+def _check_inline(schema, client_json, name):
+    """
+    The JSONException client_json doesn't validate with, or None
+    """
+    try:
+        stats = _stats
+        if stats is None:
+            schema.validate(client_json)
+        else:
+            stats.validate(name, schema, client_json)
+    except JSONException as e:
+        return e
+
+# The async decorators wrap coroutine functions with coroutine functions,
+# which need async def
+_async_def = sys.version_info >= (3, 5)
+
+def _plan_async_check(schema, threshold, executor, name, client_json):
+    """
+    For the async wrappers:  the JSONException client_json doesn't validate
+    with or None, and None, if it holds at most threshold values; otherwise
+    None, and the executor, function and arguments to check it with
+    """
+    if not _json_size_over(client_json, threshold):
+        return _check_inline(schema, client_json, name), None
+    if _is_process_pool(executor):
+        return None, (executor, _check_pickled_chunk, _pickled_once(schema), [client_json])
+    # Threads, like the loop's default executor's, share the schema
+    return None, (executor, _check_chunk, schema, [client_json])
+
+def json_validate_async(json_structure, codegen=False, threshold=10000, executor=None, limits=None):
+    """
+    Like json_validate, but if the wrapped function is an asyncio coroutine
+    function, so is the wrapper:  client input holding more than threshold
+    values in all is validated in executor, so a large input doesn't block
+    the event loop, and smaller input is validated right away.  Other
+    functions are wrapped like json_validate does.  Validations in executor
+    aren't timed by enable_validation_stats().
+    @param json_structure:  See json_validate()
+    @param codegen:         See json_validate()
+    @param threshold:       Optional, the most values to validate in the event
+                            loop
+    @param executor:        Optional, a concurrent.futures executor, by
+                            default the event loop's
+    @param limits:          See json_validate()
+    """
+    schema = _registry.compile(json_structure, codegen, limits)
+    
+    # the decorator
+    def validator_wrapper(f):
+        import inspect
+        if not _async_def or not inspect.iscoroutinefunction(f):
+            return json_validate(json_structure, codegen, limits=limits)(f)
+        
+        import _json_validate_async
+        name = _function_name(f)
+        _registry.register(name, json_structure, schema)
+        check = _json_validate_async.checker(
+            functools.partial(_plan_async_check, schema, threshold, executor, name)
+        )
+        validator = _json_validate_async.validator(f, json_structure, check)
+        
+        # Save json_structure for future use, as in doc_view.py
+        f.json_structure = json_structure
+        # Bubble up the undecorated_function attribute, even if f is already decorated
+        validator.undecorated_function = getattr(f, 'undecorated_function', f)
+        return validator
+    return validator_wrapper
+
+def json_validate_warn_async(json_structure, codegen=False, threshold=10000, executor=None,
+                             sample_rate=1.0, warning_interval=None, limits=None):
+    """
+    Like json_validate_warn, but for asyncio coroutine functions the way
+    json_validate_async() is like json_validate.
+    """
+    schema = _registry.compile(json_structure, codegen, limits)
+    
+    # the decorator
+    def validate_warner(f):
+        import inspect
+        if not _async_def or not inspect.iscoroutinefunction(f):
+            return json_validate_warn(
+                json_structure, codegen, sample_rate=sample_rate, warning_interval=warning_interval,
+                limits=limits
+            )(f)
+        
+        import _json_validate_async
+        name = _function_name(f)
+        _registry.register(name, json_structure, schema)
+        policy = _warning_policy(name, sample_rate, warning_interval)
+        check = _json_validate_async.checker(
+            functools.partial(_plan_async_check, schema, threshold, executor, name)
+        )
+        validate_warner = _json_validate_async.warner(f, check, policy, _add_warning)
+        
+        # Save json_structure for future use, as in doc_view.py
+        f.json_structure = json_structure
+        # Bubble up the undecorated_function attribute, even if f is already decorated
+        validate_warner.undecorated_function = getattr(f, 'undecorated_function', f)
+        return validate_warner
+    return validate_warner
+
+if _async_def:
+    # Examples that need async def, which Python 2 can't parse
+    __test__ = {'json_validate_async': """
+    >>> import asyncio, inspect
+    >>> class handlers:
+    ...     @json_validate_async({'ids': [int]}, threshold=10)
+    ...     async def put(self, json):
+    ...         return len(json['ids'])
+    >>> inspect.iscoroutinefunction(handlers.put)
+    True
+    >>> loop = asyncio.new_event_loop()
+    >>> loop.run_until_complete(handlers().put({'ids': [1, 2]}))
+    2
+    >>> # Too many values to check in the event loop:  checked in its executor
+    >>> try:
+    ...     loop.run_until_complete(handlers().put({'ids': list(range(100)) + ['x']}))
+    ... except JSONException as e:
+    ...     print(e)
+    Type error: client_json['ids'][100] = 'x', which is of type str.  A value of type int is required
+    >>> @json_validate_warn_async({'id': int})
+    ... async def get_item(json, context):
+    ...     return {}
+    >>> inspect.iscoroutinefunction(get_item)
+    True
+    >>> loop.run_until_complete(get_item({'id': 'one'}, {}))
+    {'warning': "Type error: client_json['id'] = 'one', which is of type str.  A value of type int is required"}
+    >>> counts = get_warning_counts(reset=True)
+    >>> loop.close()
+    """}
+
+def _resolve_schema(reference):
+    """
+    @param reference:   'module:attribute', naming a json_structure, what
+                        compile_schema() returned for one, or a function
+                        decorated with json_validate
+    """
+    module_name, _, attribute = reference.partition(':')
+    if not module_name or not attribute:
+        raise ValueError('schema must be module:attribute, not %s' % repr(reference))
+    
+    import importlib
+    schema = importlib.import_module(module_name)
+    for name in attribute.split('.'):
+        schema = getattr(schema, name)
+    
+    f = getattr(schema, 'undecorated_function', None)
+    if f is not None:
+        schema = f.json_structure
+    return schema
+
+def _line_start(data, position):
+    """
+    @return:    The start of the first line that starts at or after position
+                in data
+    """
+    if position == 0 or position >= len(data) or data[position - 1:position] == b'\n':
+        return min(position, len(data))
+    end = data.find(b'\n', position)
+    return len(data) if end == -1 else end + 1
+
+# What _init_lines_worker() compiled, in each worker process
+_lines_schema = None
+
+def _init_lines_worker(reference, codegen):
+    global _lines_schema
+    schema = _resolve_schema(reference)
+    if not isinstance(schema, _compiled_node):
+        schema = compile_schema(schema, codegen)
+    _lines_schema = schema
+
+def _check_lines(task):
+    """
+    Check the lines that start in a range of a JSON Lines file.  Each worker
+    maps the file and reads its own range, so the file isn't read or pickled
+    by the parent process.
+    @param task:    (path, start, end, the most errors to find or None)
+    @return:        (lines checked, bytes checked, list of (line number in
+                    the range, starting from 1, error message))
+    """
+    import mmap
+    path, start, end, max_errors = task
+    with open(path, 'rb') as f:
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+        start, end = _line_start(data, start), _line_start(data, end)
+        chunk = data[start:end]
+    finally:
+        data.close()
+    
+    check = _lines_schema.check
+    errors = []
+    lines = chunk.split(b'\n')
+    if not lines[-1]:
+        lines.pop()
+    n_bytes = 0
+    for i, line in enumerate(lines):
+        n_bytes += len(line) + 1
+        if not line.strip():
+            continue
+        
+        try:
+            client_json = json.loads(line.decode('utf-8'))
+        except ValueError as e:
+            message = 'Invalid JSON: %s' % e
+        else:
+            error = check(client_json)
+            if error is None:
+                continue
+            message = str(error)
+        
+        errors.append((i + 1, message))
+        if len(errors) == max_errors:
+            return i + 1, n_bytes, errors
+    
+    return len(lines), end - start, errors
+
+def _main(argv=None):
+    """
+    Check each line of a JSON Lines file against a schema, spread across
+    worker processes, print the invalid lines' numbers and error messages,
+    and report throughput:
+    
+        python -m json_validate myapp.schemas:event events.jsonl
+    
+    @return:    Exit status, 1 if any line is invalid
+    """
+    # Imported here, so that importing json_validate stays quick
+    import argparse
+    import multiprocessing
+    
+    parser = argparse.ArgumentParser(
+        prog='python -m json_validate',
+        description='Validate each line of a JSON Lines file.  Run with no arguments to run the doctests.'
+    )
+    parser.add_argument('schema', help='module:attribute naming a json_structure, a compiled schema, or a function decorated with json_validate')
+    parser.add_argument('path', help='JSON Lines file to validate')
+    parser.add_argument('--first-error', action='store_true', help='stop at the first invalid line')
+    parser.add_argument('--max-errors', type=int, help='stop after this many invalid lines')
+    parser.add_argument('--processes', type=int, help='worker processes, by default one per CPU')
+    parser.add_argument('--chunk-size', type=int, default=1 << 24, help='bytes of the file to give a worker at a time')
+    parser.add_argument('--codegen', action='store_true', help='validate with generated source; see compile_schema()')
+    args = parser.parse_args(argv)
+    max_errors = 1 if args.first_error else args.max_errors
+    
+    start_time = time.time()
+    try:
+        # Check the schema here, rather than failing in every worker
+        _init_lines_worker(args.schema, args.codegen)
+        size = os.path.getsize(args.path)
+    except (ImportError, AttributeError, ValueError, TypeError, AssertionError, OSError) as e:
+        parser.error(str(e))
+    
+    tasks = [
+        (args.path, start, min(start + args.chunk_size, size), max_errors)
+        for start in range(0, size, args.chunk_size)
+    ]
+    processes = min(args.processes or multiprocessing.cpu_count(), len(tasks))
+    pool = None
+    if processes > 1:
+        pool = multiprocessing.Pool(processes, _init_lines_worker, (args.schema, args.codegen))
+        results = pool.imap(_check_lines, tasks)
+    else:
+        results = (_check_lines(task) for task in tasks)
+    
+    # Results come in file order, so line numbers are known as they arrive
+    n_lines = n_bytes = n_errors = 0
+    try:
+        for lines, chunk_bytes, errors in results:
+            if max_errors is not None:
+                errors = errors[:max_errors - n_errors]
+            for line_number, message in errors:
+                sys.stdout.write('%s:%d: %s\n' % (args.path, n_lines + line_number, message))
+            n_lines += lines
+            n_bytes += chunk_bytes
+            n_errors += len(errors)
+            if n_errors == max_errors:
+                break
+    finally:
+        if pool is not None:
+            pool.terminate()
+    
+    elapsed = max(time.time() - start_time, 1e-6)
+    sys.stderr.write('%d lines, %d invalid, in %.2f seconds:  %d lines/second, %.1f MB/second\n' % (
+        n_lines, n_errors, elapsed, n_lines / elapsed, n_bytes / elapsed / 1e6
+    ))
+    return 1 if n_errors else 0
+
 if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        # Run the imported module rather than this copy of it, __main__, so
+        # that schemas built from json_validate's classes work here
+        import json_validate
+        sys.exit(json_validate._main())
+    
     import doctest
     doctest.testmod()